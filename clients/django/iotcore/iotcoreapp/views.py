@@ -1,26 +1,73 @@
+import json
+import time
+
 from django.shortcuts import render
 
 from django.http import HttpResponse
+from django.http import JsonResponse
 
 from lockdown.decorators import lockdown
 
 from google.cloud import bigquery
 
+from . import rollup
+from . import tables
+
 client = bigquery.Client()
 
-def read_sensor():
-    client = bigquery.Client()
-    query = 'SELECT * FROM `danarchy-io.stargaze.sensor` ORDER BY date DESC limit 1'
-    row = list(client.query(query).result())[0]
-    return str(row.date), row.temperature, row.humidity, row.flag_temperature, row.flag_humidity
+# one entry per gateway and query, the gateways are queried in parallel
+
+cache = tables.Cache(ttl=60)
+
+def read_sensors():
+    pairs = cache.get(('devices',), lambda: tables.devices(client))
+    pairs = pairs or [(tables.gateway, tables.device)]
+
+    return [
+        {
+            'gateway' : gateway,
+            'device' : device,
+            'date' : str(row.date),
+            'temperature' : row.temperature,
+            'humidity' : row.humidity,
+            'flagt' : row.flag_temperature,
+            'flagh' : row.flag_humidity,
+        }
+        for (gateway, device), row in tables.latest_fleet(client, pairs, cache).items()
+        if row
+    ]
 
 @lockdown()
 def index(request):
-    date, temperature, humidity, flagt, flagh = read_sensor()
-    return render(request, 'index.html', { 
-        'date' : date,
-        'temperature' : temperature,
-        'humidity' : humidity,
-        'flagt' : flagt,
-        'flagh' : flagh,
+    return render(request, 'index.html', {
+        'sensors' : read_sensors(),
+    })
+
+@lockdown()
+def history(request):
+    # GET /history?gateway=default&start=1622422583&end=1622509000&resolution=3600,
+    # epoch seconds, served from the coarsest rollup that has the resolution,
+    # the default end is rounded to a minute so it hits the cache
+
+    gateway = request.GET.get('gateway', tables.gateway)
+
+    try:
+        end = int(request.GET.get('end', time.time() // 60 * 60))
+        start = int(request.GET.get('start', end - 24 * 60 * 60))
+        resolution = request.GET.get('resolution')
+        resolution = int(resolution) if resolution else None
+    except ValueError:
+        return HttpResponse(status=400)
+
+    table, bucket = rollup.pick_table(start, end, resolution)
+    rows = cache.get(
+        ('history', gateway, start, end, resolution),
+        lambda: rollup.query(client, start, end, resolution, gateway)
+    )
+
+    return JsonResponse({
+        'gateway' : gateway,
+        'table' : table,
+        'bucket' : bucket,
+        'rows' : json.loads(rows.to_json(orient='records')),
     })
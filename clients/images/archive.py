@@ -0,0 +1,353 @@
+"""
+Daily image archives, the per-minute objects of a closed day bundled into
+one object, with an index of fixed size records.
+
+The agent uploads an object per frame, {prefix}/{date}.jpg, under
+iotcore/images, or iotcore/{gateway}/images, and {index} below it for
+cameras after the first. Compacting a day writes
+
+  {prefix}/archive/{day}.bin   the frames of the day, concatenated
+  {prefix}/archive/{day}.idx   header, then a record per frame
+
+Index, big endian, records sorted by date:
+
+  magic     2s  b'IX'
+  version   B   1
+  records:
+    date    q   epoch milliseconds
+    offset  Q   into the archive
+    length  I
+
+The index is written after the archive, an archive without its index is
+an interrupted compaction and is written again. A frame is a read of the
+index, 20 bytes a frame, about 29 kB for a day, and a range read of the
+archive, nothing is listed.
+
+  python archive.py compact --days 7 --delete
+  python archive.py compact --day 2021-05-31
+  python archive.py nearest --at 1622422583000 --output frame.jpg
+  python archive.py compact --root /tmp/bucket   # local directory
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import os
+import bisect
+import shutil
+import struct
+import logging
+import argparse
+import datetime
+import tempfile
+import threading
+
+from collections import namedtuple
+
+bucket = 'danarchy-io'
+prefix = 'iotcore/images'
+
+tz = datetime.timezone.utc
+
+# a day is closed once it ended grace seconds ago, late uploads included
+
+grace = 60 * 60
+
+# index
+
+MAGIC = b'IX'
+VERSION = 1
+
+header = struct.Struct('>2sB')
+record = struct.Struct('>qQI')
+
+Frame = namedtuple('Frame', ['date', 'offset', 'length'])
+
+def encode_index(frames):
+    return header.pack(MAGIC, VERSION) + b''.join(
+        record.pack(*frame) for frame in sorted(frames)
+    )
+
+def decode_index(data):
+    magic, version = header.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('unknown index {!r} version {}'.format(magic, version))
+    return [Frame(*values) for values in record.iter_unpack(data[header.size:])]
+
+# names
+
+def day_of(date):
+    # day of epoch milliseconds, as in the archive names
+    return datetime.datetime.fromtimestamp(date / 1000, tz).date()
+
+def archive_names(prefix, day):
+    base = '{}/archive/{}'.format(prefix, day.isoformat())
+    return base + '.bin', base + '.idx'
+
+def frame_date(prefix, name):
+    # epoch milliseconds of an uploaded frame, None for other objects,
+    # last.jpg, the archives, the frames of the other cameras
+
+    stem = name[len(prefix) + 1:]
+    if '/' in stem or not stem.endswith('.jpg'):
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(stem[:-len('.jpg')])
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=tz)
+    return int(round(date.timestamp() * 1000))
+
+def closed(day, now, grace=grace):
+    # now is epoch seconds
+    end = datetime.datetime.combine(day, datetime.time(), tz) + datetime.timedelta(days=1)
+    return now >= end.timestamp() + grace
+
+# stores, the archive only needs names, whole and range reads
+
+class LocalStore:
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def list(self, prefix):
+        names = list()
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                name = os.path.relpath(
+                    os.path.join(directory, file), self.root
+                ).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def get(self, name, start=None, end=None):
+        # bytes [start, end)
+        with open(self.path(name), 'rb') as file:
+            file.seek(start or 0)
+            if end is None:
+                return file.read()
+            return file.read(end - (start or 0))
+
+    def put(self, name, path):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        shutil.copyfile(path, self.path(name))
+
+    def delete(self, names):
+        for name in names:
+            os.remove(self.path(name))
+
+class GCSStore:
+
+    def __init__(self, bucket_name):
+        from google.cloud import storage
+
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+
+    def list(self, prefix):
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def get(self, name, start=None, end=None):
+        # bytes [start, end), the end of a gcs range is inclusive
+        return self.bucket.blob(name).download_as_bytes(
+            start=start, end=end - 1 if end is not None else None
+        )
+
+    def put(self, name, path):
+        self.bucket.blob(name).upload_from_filename(path)
+
+    def delete(self, names):
+        self.bucket.delete_blobs([self.bucket.blob(name) for name in names])
+
+# compaction
+
+def compact(store, prefix, day, delete=False, force=False):
+    # bundles the frames of day, returns the frames archived, None when the
+    # day was already archived, delete removes the frame objects afterwards
+
+    data_name, index_name = archive_names(prefix, day)
+
+    if not force and store.exists(index_name):
+        return None
+
+    # frames are named by their date, the day is a prefix of the name
+
+    names = [
+        (date, name)
+        for name in store.list('{}/{}'.format(prefix, day.isoformat()))
+        for date in [frame_date(prefix, name)]
+        if date is not None and day_of(date) == day
+    ]
+    names.sort()
+
+    if not names:
+        return []
+
+    # the archive goes through a temporary file, a day of frames may not
+    # fit in memory
+
+    frames = list()
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as file:
+        try:
+            for date, name in names:
+                data = store.get(name)
+                frames.append(Frame(date, file.tell(), len(data)))
+                file.write(data)
+            file.close()
+
+            store.put(data_name, file.name)
+        finally:
+            os.remove(file.name)
+
+    with tempfile.NamedTemporaryFile(suffix='.idx', delete=False) as file:
+        try:
+            file.write(encode_index(frames))
+            file.close()
+
+            store.put(index_name, file.name)
+        finally:
+            os.remove(file.name)
+
+    logging.info(
+        'archived %s frames of %s, %s bytes',
+        len(frames), day, sum(frame.length for frame in frames)
+    )
+
+    if delete:
+        store.delete([name for _, name in names])
+
+    return frames
+
+# lookup
+
+class Archive:
+
+    def __init__(self, store, prefix=prefix):
+        self.store = store
+        self.prefix = prefix
+
+        # indexes of closed days don't change, a missing one may be written
+        # by the next compaction
+
+        self.indexes = dict()
+        self.lock = threading.Lock()
+
+    def index(self, day):
+        with self.lock:
+            if day in self.indexes:
+                return self.indexes[day]
+
+        _, index_name = archive_names(self.prefix, day)
+        if not self.store.exists(index_name):
+            return []
+
+        frames = decode_index(self.store.get(index_name))
+        with self.lock:
+            self.indexes[day] = frames
+        return frames
+
+    def frame(self, day, frame):
+        data_name, _ = archive_names(self.prefix, day)
+        return self.store.get(data_name, frame.offset, frame.offset + frame.length)
+
+    def closest(self, day, date):
+        # (distance, day, frame) of the frame of day nearest date, or None
+
+        frames = self.index(day)
+        index = bisect.bisect_left(frames, (date,))
+        return min(
+            (
+                (abs(frame.date - date), day, frame)
+                for frame in frames[max(index - 1, 0):index + 1]
+            ),
+            default=None
+        )
+
+    def nearest(self, date):
+        # (date, image) of the archived frame nearest date, epoch
+        # milliseconds, None when neither the day nor its neighbours have one
+
+        day = day_of(date)
+        start = int(datetime.datetime.combine(day, datetime.time(), tz).timestamp() * 1000)
+        end = start + 24 * 60 * 60 * 1000
+
+        # the neighbours are read only when midnight is nearer than the
+        # nearest frame of the day
+
+        best = self.closest(day, date)
+        for other, distance in ((-1, date - start), (1, end - date)):
+            if best is None or best[0] > distance:
+                found = self.closest(day + datetime.timedelta(days=other), date)
+                if found is not None and (best is None or found < best):
+                    best = found
+
+        if best is None:
+            return None
+
+        _, day, frame = best
+        return frame.date, self.frame(day, frame)
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('command', choices=['compact', 'nearest'])
+    parser.add_argument('--bucket', default=bucket)
+    parser.add_argument('--root', help='local directory instead of the bucket')
+    parser.add_argument('--prefix', default=prefix)
+    parser.add_argument('--day', help='yyyy-mm-dd', type=datetime.date.fromisoformat)
+    parser.add_argument('--days', help='closed days before today', type=int, default=1)
+    parser.add_argument('--delete', help='delete the archived frames', action='store_true')
+    parser.add_argument('--force', help='archive again', action='store_true')
+    parser.add_argument('--at', help='epoch milliseconds', type=int)
+    parser.add_argument('--output', default='frame.jpg')
+    parser.add_argument('--loglevel', default='INFO')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.loglevel),
+        format='%(asctime)s %(levelname)s %(message)s'
+    )
+
+    store = LocalStore(args.root) if args.root else GCSStore(args.bucket)
+
+    if args.command == 'compact':
+        now = datetime.datetime.now(tz)
+        days = [args.day] if args.day else [
+            now.date() - datetime.timedelta(days=days)
+            for days in range(args.days, 0, -1)
+        ]
+        for day in days:
+            if not closed(day, now.timestamp()):
+                print('{} is not closed'.format(day))
+                continue
+            frames = compact(store, args.prefix, day, args.delete, args.force)
+            if frames is None:
+                print('{} already archived'.format(day))
+            else:
+                print('{} archived {} frames'.format(day, len(frames)))
+
+    if args.command == 'nearest':
+        found = Archive(store, args.prefix).nearest(args.at)
+        if found is None:
+            print('no frame')
+        else:
+            date, image = found
+            with open(args.output, 'wb') as file:
+                file.write(image)
+            print('{} {} bytes => {}'.format(date, len(image), args.output))
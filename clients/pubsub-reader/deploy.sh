@@ -1,9 +1,38 @@
 #!/usr/bin/env bash
 
+BASEPATH="$( cd "$(dirname "$0")" >/dev/null 2>&1 ; pwd -P )"
+
+# telemetry.py is shared with the agent, copy the sources dereferencing
+# the symlink
+
+SOURCE=`mktemp -d`
+trap "rm -rf ${SOURCE}" EXIT
+cp -L ${BASEPATH}/*.py ${BASEPATH}/requirements.txt ${SOURCE}/
+
+# the table schema is deployed with the function, so the cold start
+# doesn't fetch it, refreshed from the table into the deployed sources
+# when bq is available, the committed schema is the fallback and is never
+# modified
+
+cp ${BASEPATH}/schema.json ${SOURCE}/
+
+if command -v bq >/dev/null 2>&1; then
+    SCHEMA=`mktemp`
+    if bq show --schema --format=prettyjson danarchy-io:stargaze.readings > ${SCHEMA} \
+        && python3 -c 'import json, sys; assert json.load(open(sys.argv[1]))' ${SCHEMA}; then
+        cp ${SCHEMA} ${SOURCE}/schema.json
+    else
+        echo "deploying ${BASEPATH}/schema.json, bq show failed"
+    fi
+    rm -f ${SCHEMA}
+fi
+
 gcloud functions deploy raspberry-events \
     --project danarchy-io \
     --runtime python37 \
     --memory 128MB \
     --entry-point main \
     --max-instances 1 \
-    --trigger-topic raspberry-events
\ No newline at end of file
+    --source ${SOURCE} \
+    --set-env-vars SENSOR_PREFIX=sensor \
+    --trigger-topic raspberry-events
@@ -1,39 +1,144 @@
+import time
+
+cold_start_ts = time.monotonic()
+
+import os
 import sys
+import json
 import base64
-import datetime
 import logging
+import threading
+
+import rollup
+import tables
+import telemetry
+
+# bigquery, created on the first event that needs it, the table schema is
+# read from schema.json, deployed with the function, or a copy in /tmp, so
+# the cold start doesn't wait for a get_table call
+
+dataset = 'stargaze'
+table_name = tables.table
+
+# sensors of every gateway, device ids starting with the prefix, e.g.
+# sensor, sensor-greenhouse-2
+
+sensor_prefix = os.environ.get('SENSOR_PREFIX', 'sensor')
+
+schema_paths = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.json'),
+    '/tmp/schema.json',
+]
+
+client = None
+table = None
+rollups = None
+lock_table = threading.Lock()
+
+# instrumentation, import and initialization are cold start costs, the
+# rest is per event, printed as a json line, which the functions logging
+# agent parses into a structured entry
+
+import_ms = (time.monotonic() - cold_start_ts) * 1000
+init_ms = None
+invocations = 0
+
+def get_table():
+    global client, table, rollups, init_ms
+
+    with lock_table:
+        if table is not None:
+            return client, table, rollups
+
+        since = time.monotonic()
 
-from google.cloud import bigquery
+        from google.cloud import bigquery
 
-client = bigquery.Client()
-dataset_ref = client.dataset('stargaze')
-table = client.get_table(client.dataset('stargaze').table('sensor'))
+        client = bigquery.Client()
+        table_ref = client.dataset(dataset).table(table_name)
+
+        for path in schema_paths:
+            if os.path.exists(path):
+                table = bigquery.Table(
+                    table_ref, schema=client.schema_from_json(path)
+                )
+                break
+        else:
+            table = client.get_table(table_ref)
+            try:
+                client.schema_to_json(table.schema, schema_paths[-1])
+            except OSError:
+                logging.exception('while caching the schema')
+
+        rollups = rollup.Rollup(client)
+
+        init_ms = (time.monotonic() - since) * 1000
+
+        return client, table, rollups
+
+def accepted(attributes):
+    return attributes.get('deviceId', '').startswith(sensor_prefix)
 
 def main(event, context):
     # message
     # "{
-    #     '@type': 'type.googleapis.com/google.pubsub.v1.PubsubMessage', 
+    #     '@type': 'type.googleapis.com/google.pubsub.v1.PubsubMessage',
     #     'attributes': {
-    #         'deviceId': 'sensor', 
-    #         'deviceNumId': '2667186399411002', 
-    #         'deviceRegistryId': 'raspberry', 
-    #         'deviceRegistryLocation': 'us-central1', 
-    #         'gatewayId': 'default', 
-    #         'projectId': 'danarchy-io', 
+    #         'deviceId': 'sensor',
+    #         'deviceNumId': '2667186399411002',
+    #         'deviceRegistryId': 'raspberry',
+    #         'deviceRegistryLocation': 'us-central1',
+    #         'gatewayId': 'default',
+    #         'projectId': 'danarchy-io',
     #         'subFolder': ''
-    #     }, 
+    #     },
     #     'data': 'MjAyMS0wNS0zMSAwMDo1NjoyMy45NzQ3ODIrMDA6MDAsMC4wMCwwLjAwLDEsMQ=='
     # }"
+    # data is binary telemetry or legacy csv, see telemetry.py
     # # context.event_id, context.timestamp, context.resource["name"]
 
-    if 'data' in event and 'attributes' in event:
-         if 'deviceId' in event['attributes']:
-             if event['attributes']['deviceId'] == 'sensor':
-                data = base64.b64decode(event['data']).decode('utf-8')
-                date, h, t, flag_h, flag_t = data.split(',')
-                date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f%z')
-                date = int(date.timestamp())
-                rows = [(date, h, t, flag_h, flag_t)]
-                errors = client.insert_rows(table, rows)
-                logging.error('rows = %s. error = %s', rows, errors)
-                assert errors == []
\ No newline at end of file
+    global invocations
+
+    # fast path, events from other devices never touch bigquery
+
+    if 'data' not in event or 'attributes' not in event:
+        return
+    if not accepted(event['attributes']):
+        return
+
+    since = time.monotonic()
+    cold = init_ms is None
+
+    data = base64.b64decode(event['data'])
+    reading = telemetry.decode(data)
+    rows = [tables.row(
+        reading,
+        event['attributes'].get('gatewayId', ''),
+        event['attributes']['deviceId']
+    )]
+
+    client, table, rollups = get_table()
+    errors = client.insert_rows(table, rows)
+    if errors:
+        logging.error('rows = %s. error = %s', rows, errors)
+    assert errors == []
+
+    # the row is in, a failed merge is retried with the next closed bucket
+    # instead of failing the event and inserting the row twice
+
+    try:
+        merged = rollups.observe(reading.date // 1000)
+    except Exception:
+        logging.exception('while merging rollups')
+        merged = []
+
+    invocations += 1
+
+    print(json.dumps({
+        'cold' : cold,
+        'invocations' : invocations,
+        'merged' : merged,
+        'import_ms' : round(import_ms, 1),
+        'init_ms' : round(init_ms, 1) if cold else 0,
+        'event_ms' : round((time.monotonic() - since) * 1000 - (init_ms if cold else 0), 1),
+    }), flush=True)
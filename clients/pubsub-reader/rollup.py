@@ -0,0 +1,313 @@
+"""
+Minute, hour and day rollups of the readings table, maintained as rows
+arrive.
+
+The reader observes the date of every row, when a bucket closes it is
+merged from the level below, minutes from the raw table, hours from
+minutes, days from hours. Rows arriving late, after an outage, mark their
+buckets dirty again. Merges are idempotent, a bucket is recomputed from
+the level below and upserted on its date.
+
+Rollup columns, one row per gateway, device and bucket:
+
+  gateway           STRING
+  device            STRING
+  date              INTEGER  bucket start, epoch seconds
+  count             INTEGER  raw rows
+  flagged           INTEGER  raw rows with a flag set
+  humidity_min      FLOAT
+  humidity_avg      FLOAT
+  humidity_max      FLOAT
+  temperature_min   FLOAT
+  temperature_avg   FLOAT
+  temperature_max   FLOAT
+
+Dashboards call query(client, start, end, resolution, gateway), which
+reads the coarsest table that still has the resolution.
+
+  python rollup.py create
+  python rollup.py backfill --start 1622422583 --end 1622509000
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+
+from collections import OrderedDict
+
+# raw readings, see tables.py
+
+dataset = 'danarchy-io.stargaze'
+source = 'readings'
+
+# levels, finest first, table and bucket size in seconds
+
+levels = OrderedDict([
+    ('sensor_minute', 60),
+    ('sensor_hour', 60 * 60),
+    ('sensor_day', 24 * 60 * 60),
+])
+
+# without a resolution, queries return about this many buckets
+
+points = 1000
+
+# sql
+
+columns = [
+    ('gateway', 'STRING'),
+    ('device', 'STRING'),
+    ('date', 'INTEGER'),
+    ('count', 'INTEGER'),
+    ('flagged', 'INTEGER'),
+    ('humidity_min', 'FLOAT64'),
+    ('humidity_avg', 'FLOAT64'),
+    ('humidity_max', 'FLOAT64'),
+    ('temperature_min', 'FLOAT64'),
+    ('temperature_avg', 'FLOAT64'),
+    ('temperature_max', 'FLOAT64'),
+]
+
+def aggregate(table, bucket, gateway=False):
+    # select grouping table in buckets of bucket seconds, the raw table and
+    # the rollups give the same columns, the raw table is partitioned on ts,
+    # filtering on it prunes the scan to the days of the range, gateway
+    # filters on @gateway
+
+    where = 'date >= @start AND date < @end'
+
+    if gateway:
+        where += ' AND gateway = @gateway'
+
+    if table == source:
+        where += (
+            ' AND ts >= TIMESTAMP_SECONDS(@start)'
+            ' AND ts < TIMESTAMP_SECONDS(@end)'
+        )
+        expressions = [
+            'COUNT(*) AS count',
+            'COUNTIF(flag_humidity != 0 OR flag_temperature != 0) AS flagged',
+        ]
+        for name in ('humidity', 'temperature'):
+            expressions += [
+                'MIN({0}) AS {0}_min'.format(name),
+                'AVG({0}) AS {0}_avg'.format(name),
+                'MAX({0}) AS {0}_max'.format(name),
+            ]
+    else:
+        expressions = [
+            'SUM(count) AS count',
+            'SUM(flagged) AS flagged',
+        ]
+        for name in ('humidity', 'temperature'):
+            expressions += [
+                'MIN({0}_min) AS {0}_min'.format(name),
+                'SUM({0}_avg * count) / SUM(count) AS {0}_avg'.format(name),
+                'MAX({0}_max) AS {0}_max'.format(name),
+            ]
+
+    return '''
+        SELECT
+            gateway,
+            device,
+            date - MOD(date, {bucket}) AS date,
+            {expressions}
+        FROM
+            `{dataset}.{table}`
+        WHERE
+            {where}
+        GROUP BY
+            1, 2, 3
+    '''.format(
+        bucket=bucket,
+        where=where,
+        expressions=',\n            '.join(expressions),
+        dataset=dataset,
+        table=table
+    )
+
+def create(table):
+    return '''
+        CREATE TABLE IF NOT EXISTS `{dataset}.{table}` ({columns})
+        CLUSTER BY gateway, device
+    '''.format(
+        dataset=dataset,
+        table=table,
+        columns=', '.join('{} {}'.format(*c) for c in columns)
+    )
+
+def merge(table):
+    # upsert the buckets of table in [@start, @end) from the level below
+
+    names = [source] + list(levels)
+    below = names[names.index(table) - 1]
+
+    return '''
+        MERGE `{dataset}.{table}` T
+        USING ({select}) S
+        ON T.gateway = S.gateway AND T.device = S.device AND T.date = S.date
+        WHEN MATCHED THEN
+            UPDATE SET {update}
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+    '''.format(
+        dataset=dataset,
+        table=table,
+        select=aggregate(below, levels[table]),
+        update=', '.join('{0} = S.{0}'.format(c) for c, _ in columns[3:])
+    )
+
+def parameters(start, end, gateway=None):
+    from google.cloud import bigquery
+
+    values = [
+        bigquery.ScalarQueryParameter('start', 'INT64', int(start)),
+        bigquery.ScalarQueryParameter('end', 'INT64', int(end)),
+    ]
+    if gateway is not None:
+        values.append(bigquery.ScalarQueryParameter('gateway', 'STRING', gateway))
+
+    return bigquery.QueryJobConfig(query_parameters=values)
+
+# ingest
+
+class Rollup:
+
+    def __init__(self, client):
+        self.client = client
+        self.latest = None
+        self.dirty = {table : set() for table in levels}
+
+    def close(self, date):
+        # date of a row just inserted, epoch seconds, returns the (table,
+        # start, end) to merge, finest first
+
+        first = list(levels)[0]
+        size = levels[first]
+
+        # the bucket open when the previous instance stopped may never have
+        # been merged
+
+        if self.latest is None:
+            self.dirty[first].add(date - date % size - size)
+
+        self.dirty[first].add(date - date % size)
+        self.latest = date if self.latest is None else max(self.latest, date)
+
+        ranges = list()
+        names = list(levels)
+        for index, table in enumerate(names):
+            size = levels[table]
+            current = self.latest - self.latest % size
+
+            closed = sorted(b for b in self.dirty[table] if b < current)
+            if not closed:
+                continue
+
+            ranges.append((table, closed[0], closed[-1] + size))
+
+            self.dirty[table].difference_update(closed)
+            if index + 1 < len(names):
+                above = levels[names[index + 1]]
+                self.dirty[names[index + 1]].update(b - b % above for b in closed)
+
+        return ranges
+
+    def observe(self, date):
+        # merges the buckets closed by date, a failed merge and the ones
+        # after it are dirty again, returns the merged ranges
+
+        return self.observe_many([date])
+
+    def close_many(self, dates):
+        # as close, the ranges closed by dates in one range per level,
+        # buckets in between not dirty are merged again, merges are
+        # idempotent
+
+        closed = dict()
+        for date in sorted(dates):
+            for table, start, end in self.close(date):
+                if table in closed:
+                    start = min(start, closed[table][0])
+                    end = max(end, closed[table][1])
+                closed[table] = (start, end)
+
+        return [(table,) + closed[table] for table in levels if table in closed]
+
+    def observe_many(self, dates):
+        # as observe, a merge per level however many buckets dates close
+
+        ranges = self.close_many(dates)
+
+        for index, (table, start, end) in enumerate(ranges):
+            try:
+                self.client.query(
+                    merge(table), job_config=parameters(start, end)
+                ).result()
+            except Exception:
+                for table, start, end in ranges[index:]:
+                    self.dirty[table].update(range(start, end, levels[table]))
+                raise
+
+        return ranges
+
+# dashboards
+
+def pick_table(start, end, resolution=None):
+    # coarsest table with buckets no larger than resolution seconds, the
+    # default resolution gives about points buckets over the range
+
+    if resolution is None:
+        resolution = max((end - start) // points, 1)
+
+    picked = source
+    for table, size in levels.items():
+        if size <= resolution:
+            picked = table
+
+    # buckets are whole multiples of the table buckets
+
+    size = levels.get(picked, 1)
+    return picked, max(resolution - resolution % size, size)
+
+def query(client, start, end, resolution=None, gateway=None):
+    # dataframe of the buckets in [start, end), epoch seconds, of every
+    # device of gateway, or of the whole fleet
+
+    table, bucket = pick_table(start, end, resolution)
+
+    return client.query(
+        aggregate(table, bucket, gateway is not None) + ' ORDER BY date',
+        job_config=parameters(start, end, gateway)
+    ).to_dataframe()
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('command', choices=['create', 'backfill'])
+    parser.add_argument('--start', help='epoch seconds', type=int, default=0)
+    parser.add_argument('--end', help='epoch seconds', type=int)
+
+    args = parser.parse_args()
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client()
+
+    if args.command == 'create':
+        for table in levels:
+            client.query(create(table)).result()
+            print('created {}.{}'.format(dataset, table))
+
+    if args.command == 'backfill':
+        end = args.end or int(time.time())
+        for table, size in levels.items():
+            start = args.start - args.start % size
+            client.query(merge(table), job_config=parameters(start, end)).result()
+            print('merged {} [{}, {})'.format(table, start, end))
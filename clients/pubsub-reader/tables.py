@@ -0,0 +1,258 @@
+"""
+Readings table, partitioned by day and clustered by gateway and device.
+
+The legacy sensor table has an integer date and no partitioning, every
+query scans all of it. Readings has a ts timestamp partition column, and
+queries must filter on it, so reading the latest value scans a day of
+data however long the history grows, and clustering keeps a gateway's
+query to its own blocks however many gateways there are.
+
+Columns:
+
+  ts                TIMESTAMP  partition column
+  gateway           STRING     cluster column
+  device            STRING     cluster column
+  date              INTEGER    epoch seconds, as in the legacy table
+  humidity          FLOAT
+  temperature       FLOAT
+  flag_humidity     INTEGER
+  flag_temperature  INTEGER
+
+Migration, the legacy table is left in place:
+
+  python tables.py create
+  ./deploy.sh                   # the reader writes to readings
+  python tables.py migrate      # copies the legacy rows older than readings
+  python tables.py latest --gateway default --device sensor
+  python tables.py devices
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import time
+import argparse
+import datetime
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+dataset = 'danarchy-io.stargaze'
+table = 'readings'
+legacy = 'sensor'
+
+gateway = 'default'
+device = 'sensor'
+
+# windows tried in turn by latest, days
+
+windows = [1, 7, 30, 365]
+
+# sql
+
+def create():
+    return '''
+        CREATE TABLE IF NOT EXISTS `{dataset}.{table}` (
+            ts TIMESTAMP NOT NULL,
+            gateway STRING NOT NULL,
+            device STRING NOT NULL,
+            date INTEGER,
+            humidity FLOAT64,
+            temperature FLOAT64,
+            flag_humidity INTEGER,
+            flag_temperature INTEGER
+        )
+        PARTITION BY DATE(ts)
+        CLUSTER BY gateway, device
+        OPTIONS (require_partition_filter = TRUE)
+    '''.format(dataset=dataset, table=table)
+
+def migrate():
+    # idempotent, only legacy rows older than the oldest reading are copied
+
+    return '''
+        INSERT INTO `{dataset}.{table}`
+        SELECT
+            TIMESTAMP_SECONDS(date) AS ts,
+            @gateway AS gateway,
+            @device AS device,
+            date,
+            humidity,
+            temperature,
+            flag_humidity,
+            flag_temperature
+        FROM
+            `{dataset}.{legacy}`
+        WHERE
+            date < IFNULL((
+                SELECT MIN(date) FROM `{dataset}.{table}`
+                WHERE ts > TIMESTAMP('1970-01-01')
+            ), 9223372036854775807)
+    '''.format(dataset=dataset, table=table, legacy=legacy)
+
+def latest_query():
+    return '''
+        SELECT
+            *
+        FROM
+            `{dataset}.{table}`
+        WHERE
+            ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+            AND gateway = @gateway
+            AND device = @device
+        ORDER BY
+            ts DESC
+        LIMIT 1
+    '''.format(dataset=dataset, table=table)
+
+def devices_query():
+    return '''
+        SELECT DISTINCT
+            gateway,
+            device
+        FROM
+            `{dataset}.{table}`
+        WHERE
+            ts >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+        ORDER BY
+            gateway, device
+    '''.format(dataset=dataset, table=table)
+
+def parameters(**values):
+    from google.cloud import bigquery
+
+    types = {int : 'INT64', str : 'STRING'}
+
+    return bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter(name, types[type(value)], value)
+        for name, value in values.items()
+    ])
+
+# rows
+
+def row(reading, gateway, device):
+    # insert_rows row of a telemetry reading
+
+    return {
+        'ts' : datetime.datetime.fromtimestamp(
+            reading.date / 1000, datetime.timezone.utc
+        ),
+        'gateway' : gateway,
+        'device' : device,
+        'date' : reading.date // 1000,
+        'humidity' : reading.humidity,
+        'temperature' : reading.temperature,
+        'flag_humidity' : reading.flag_humidity,
+        'flag_temperature' : reading.flag_temperature,
+    }
+
+# queries
+
+def latest(client, gateway=gateway, device=device):
+    # latest reading of device, looks back a day, then widens, None when
+    # there is no reading in a year
+
+    for days in windows:
+        rows = list(client.query(
+            latest_query(),
+            job_config=parameters(days=days, gateway=gateway, device=device)
+        ).result())
+        if rows:
+            return rows[0]
+
+    return None
+
+def devices(client, days=7):
+    # (gateway, device) that sent readings in the last days
+
+    return [
+        (row.gateway, row.device)
+        for row in client.query(
+            devices_query(), job_config=parameters(days=days)
+        ).result()
+    ]
+
+# fleet, the dashboards query each gateway in parallel and cache each
+# answer on its own, a slow or empty gateway doesn't hold the others
+
+class Cache:
+
+    def __init__(self, ttl=60, size=256):
+        # history keys move with the time, expired entries are dropped as
+        # new ones are stored, and the oldest beyond size
+
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, function):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        value = function()
+        with self.lock:
+            now = time.monotonic()
+            self.entries.pop(key, None)
+            self.entries[key] = (now, value)
+
+            # entries are in the order they were stored, oldest first
+            while self.entries:
+                oldest, (stored, _) = next(iter(self.entries.items()))
+                if now - stored < self.ttl and len(self.entries) <= self.size:
+                    break
+                del self.entries[oldest]
+        return value
+
+def latest_fleet(client, pairs, cache, workers=8):
+    # {(gateway, device) : latest reading or None}
+
+    def fetch(pair):
+        return cache.get(('latest',) + pair, lambda: latest(client, *pair))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(pairs, executor.map(fetch, pairs)))
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'command',
+        choices=['create', 'migrate', 'latest', 'devices']
+    )
+    parser.add_argument('--gateway', default=gateway)
+    parser.add_argument('--device', default=device)
+
+    args = parser.parse_args()
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client()
+
+    if args.command == 'create':
+        client.query(create()).result()
+        print('created {}.{}'.format(dataset, table))
+
+    if args.command == 'migrate':
+        job = client.query(migrate(), job_config=parameters(
+            gateway=args.gateway, device=args.device
+        ))
+        job.result()
+        print('copied {} rows from {}.{}'.format(
+            job.num_dml_affected_rows, dataset, legacy
+        ))
+
+    if args.command == 'latest':
+        row = latest(client, args.gateway, args.device)
+        print(dict(row.items()) if row else None)
+
+    if args.command == 'devices':
+        for pair in devices(client):
+            print('{} {}'.format(*pair))
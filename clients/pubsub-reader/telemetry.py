@@ -0,0 +1 @@
+../../iotcore/telemetry.py
\ No newline at end of file
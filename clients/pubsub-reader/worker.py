@@ -0,0 +1,438 @@
+"""
+Streaming pull ingest worker, an alternative to the function in main.py.
+
+The function pays an invocation and a single row insert per reading. The
+worker holds a streaming pull open, with flow control bounding the
+messages outstanding, gathers them into batches, decodes a batch in one
+pass and inserts it in bulk. Messages are acked only once their rows are
+written, a failed write nacks them and they are redelivered. Message ids
+are the insert ids, so bigquery drops most rows redelivered after a
+partial write.
+
+Needs google-cloud-pubsub besides requirements.txt. Deploy only one of the
+function and the worker, each subscribes to raspberry-events on its own.
+
+  python worker.py --create
+  python worker.py
+
+Against the emulator, with synthetic readings and the fake sink:
+
+  gcloud beta emulators pubsub start --project=local
+  export PUBSUB_EMULATOR_HOST=localhost:8085
+  python worker.py --project local --create --publish 10000 --sink fake
+
+Throughput of the function path against the worker, no pubsub needed:
+
+  python worker.py --benchmark 2000
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import concurrent.futures
+
+import main
+import tables
+import telemetry
+
+project = 'danarchy-io'
+topic = 'raspberry-events'
+subscription = 'raspberry-events-worker'
+
+# sinks
+
+class BigQuerySink:
+
+    def __init__(self, chunk=5000):
+        # chunk is the rows per insert_rows request
+        self.chunk = chunk
+
+    def write(self, rows, ids):
+        client, table, rollups = main.get_table()
+
+        for start in range(0, len(rows), self.chunk):
+            errors = client.insert_rows(
+                table,
+                rows[start:start + self.chunk],
+                row_ids=ids[start:start + self.chunk]
+            )
+            if errors:
+                logging.error('%s rows. error = %s', len(rows), errors[:10])
+                raise RuntimeError('insert_rows failed for {} rows'.format(len(errors)))
+
+        # the rows are in, as in the function a failed merge is retried with
+        # the next closed bucket, the batch is a merge per level at most,
+        # however many buckets it closes
+
+        try:
+            rollups.observe_many({row['date'] for row in rows})
+        except Exception:
+            logging.exception('while merging rollups')
+
+class FakeSink:
+
+    def __init__(self, latency=0.02, row_latency=0.00002):
+        # latency per write and per row, seconds, about a streaming insert
+        self.latency = latency
+        self.row_latency = row_latency
+        self.rows = 0
+        self.writes = 0
+
+    def write(self, rows, ids):
+        time.sleep(self.latency + self.row_latency * len(rows))
+        self.rows += len(rows)
+        self.writes += 1
+
+# batches
+
+class Batcher:
+
+    def __init__(self, sink, batch=1000, linger=1.0):
+        # a batch is written when it has batch messages or its first message
+        # waited linger seconds
+
+        self.sink = sink
+        self.batch = batch
+        self.linger = linger
+
+        self.pending = list()
+        self.first = None
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+        self.acked = 0
+        self.nacked = 0
+        self.ignored = 0
+        self.undecodable = 0
+
+    def start(self):
+        self.thread = threading.Thread(
+            name='thread_flush',
+            target=self.loop,
+            daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        # writes what is pending
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def add(self, message):
+        # subscriber callback, events from other devices are acked right away
+
+        if not main.accepted(message.attributes):
+            message.ack()
+            self.ignored += 1
+            return
+
+        # the linger of a batch starts with its first message
+
+        with self.condition:
+            if not self.pending:
+                self.first = time.monotonic()
+            self.pending.append(message)
+            if len(self.pending) == 1 or len(self.pending) >= self.batch:
+                self.condition.notify()
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                while len(self.pending) < self.batch and not self.stopped:
+                    remaining = self.first + self.linger - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(timeout=remaining)
+                if not self.pending and self.stopped:
+                    return
+
+                # what is left over from a full batch waited as long, the
+                # first message is kept
+                messages = self.pending[:self.batch]
+                self.pending = self.pending[self.batch:]
+
+            # a batch that fails unexpectedly is redelivered, the thread
+            # goes on with the next
+
+            try:
+                self.flush(messages)
+            except Exception:
+                logging.exception('while flushing %s messages', len(messages))
+                for message in messages:
+                    message.nack()
+                self.nacked += len(messages)
+
+    def flush(self, messages):
+        readings = telemetry.decode_many([message.data for message in messages])
+
+        rows = list()
+        ids = list()
+        written = list()
+
+        for message, reading in zip(messages, readings):
+            # redelivering an undecodable message won't decode it
+            if reading is None:
+                logging.warning(
+                    'undecodable message %s from %s',
+                    message.message_id, message.attributes.get('deviceId')
+                )
+                message.ack()
+                self.undecodable += 1
+                continue
+
+            rows.append(tables.row(
+                reading,
+                message.attributes.get('gatewayId', ''),
+                message.attributes['deviceId']
+            ))
+            ids.append(message.message_id)
+            written.append(message)
+
+        try:
+            if rows:
+                self.sink.write(rows, ids)
+        except Exception:
+            logging.exception('while writing %s rows', len(rows))
+            for message in written:
+                message.nack()
+            self.nacked += len(written)
+            return
+
+        for message in written:
+            message.ack()
+        self.acked += len(written)
+
+# pubsub
+
+def create(project, topic, subscription):
+    from google.api_core.exceptions import AlreadyExists
+    from google.cloud import pubsub_v1
+
+    publisher = pubsub_v1.PublisherClient()
+    subscriber = pubsub_v1.SubscriberClient()
+
+    try:
+        publisher.create_topic(request={'name' : publisher.topic_path(project, topic)})
+    except AlreadyExists:
+        pass
+
+    try:
+        subscriber.create_subscription(request={
+            'name' : subscriber.subscription_path(project, subscription),
+            'topic' : publisher.topic_path(project, topic),
+            'ack_deadline_seconds' : 60,
+        })
+    except AlreadyExists:
+        pass
+
+def publish(project, topic, count, gateway=tables.gateway, device=tables.device):
+    # synthetic readings, a second apart, ending now
+
+    from google.cloud import pubsub_v1
+
+    publisher = pubsub_v1.PublisherClient()
+    path = publisher.topic_path(project, topic)
+
+    now = int(time.time() * 1000)
+    futures = [
+        publisher.publish(
+            path,
+            telemetry.encode(
+                now - (count - index) * 1000,
+                random.uniform(40, 60),
+                random.uniform(15, 25)
+            ),
+            deviceId=device,
+            gatewayId=gateway
+        )
+        for index in range(count)
+    ]
+    for future in futures:
+        future.result()
+
+def subscribe(project, subscription, batcher, outstanding):
+    from google.cloud import pubsub_v1
+
+    subscriber = pubsub_v1.SubscriberClient()
+
+    # outstanding bounds the messages held in memory, unacked, it should be
+    # a few batches so the next batch fills while one is written
+
+    future = subscriber.subscribe(
+        subscriber.subscription_path(project, subscription),
+        callback=batcher.add,
+        flow_control=pubsub_v1.types.FlowControl(max_messages=outstanding)
+    )
+
+    return subscriber, future
+
+# benchmark
+
+class FakeMessage:
+
+    def __init__(self, data, attributes, message_id):
+        self.data = data
+        self.attributes = attributes
+        self.message_id = message_id
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+def fake_messages(count, gateway=tables.gateway, device=tables.device):
+    now = int(time.time() * 1000)
+    return [
+        FakeMessage(
+            telemetry.encode(
+                now - (count - index) * 1000,
+                random.uniform(40, 60),
+                random.uniform(15, 25)
+            ),
+            {'deviceId' : device, 'gatewayId' : gateway},
+            str(index)
+        )
+        for index in range(count)
+    ]
+
+def function_path(messages, sink):
+    # what main does per event, less the invocation overhead
+
+    for message in messages:
+        if not main.accepted(message.attributes):
+            message.ack()
+            continue
+        reading = telemetry.decode(message.data)
+        sink.write([tables.row(
+            reading,
+            message.attributes.get('gatewayId', ''),
+            message.attributes['deviceId']
+        )], [message.message_id])
+        message.ack()
+
+def benchmark(count, batch, linger, latency, row_latency):
+    results = dict()
+
+    for name in ('function', 'worker'):
+        messages = fake_messages(count)
+        sink = FakeSink(latency, row_latency)
+
+        since = time.monotonic()
+        if name == 'function':
+            function_path(messages, sink)
+        else:
+            batcher = Batcher(sink, batch=batch, linger=linger)
+            batcher.start()
+            for message in messages:
+                batcher.add(message)
+            batcher.stop()
+        elapsed = time.monotonic() - since
+
+        assert all(message.acked for message in messages)
+
+        results[name] = {
+            'messages' : count,
+            'writes' : sink.writes,
+            'seconds' : round(elapsed, 3),
+            'per_second' : round(count / elapsed, 1),
+        }
+
+    results['speedup'] = round(
+        results['worker']['per_second'] / results['function']['per_second'], 1
+    )
+
+    return results
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--project', default=project)
+    parser.add_argument('--topic', default=topic)
+    parser.add_argument('--subscription', default=subscription)
+    parser.add_argument('--sink', choices=['bigquery', 'fake'], default='bigquery')
+    parser.add_argument('--batch', help='messages per write', type=int, default=1000)
+    parser.add_argument('--linger', help='seconds', type=float, default=1.0)
+    parser.add_argument('--outstanding', help='messages, default 4 batches', type=int)
+    parser.add_argument('--create', help='create topic and subscription', action='store_true')
+    parser.add_argument('--publish', help='publish synthetic readings', type=int, default=0)
+    parser.add_argument('--benchmark', help='messages, compare with the function path', type=int)
+    parser.add_argument('--latency', help='fake sink seconds per write', type=float, default=0.02)
+    parser.add_argument('--row-latency', help='fake sink seconds per row', type=float, default=0.00002)
+    parser.add_argument('--interval', help='seconds between stats', type=float, default=10)
+    parser.add_argument('--loglevel', default='INFO')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.loglevel),
+        format='%(asctime)s %(levelname)s %(threadName)s %(message)s'
+    )
+
+    if args.benchmark:
+        print(json.dumps(benchmark(
+            args.benchmark, args.batch, args.linger, args.latency, args.row_latency
+        )))
+        sys.exit(0)
+
+    if args.create:
+        create(args.project, args.topic, args.subscription)
+
+    if args.publish:
+        publish(args.project, args.topic, args.publish)
+
+    if args.sink == 'fake':
+        sink = FakeSink(args.latency, args.row_latency)
+    else:
+        sink = BigQuerySink()
+
+    batcher = Batcher(sink, batch=args.batch, linger=args.linger)
+    batcher.start()
+
+    subscriber, future = subscribe(
+        args.project,
+        args.subscription,
+        batcher,
+        args.outstanding or 4 * args.batch
+    )
+
+    logging.info('pulling %s', args.subscription)
+
+    # stats as json lines, as the function prints per event
+
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                future.result(timeout=args.interval)
+            except concurrent.futures.TimeoutError:
+                pass
+            print(json.dumps({
+                'acked' : batcher.acked,
+                'nacked' : batcher.nacked,
+                'ignored' : batcher.ignored,
+                'undecodable' : batcher.undecodable,
+                'per_second' : round(batcher.acked / (time.monotonic() - started), 1),
+            }), flush=True)
+    except KeyboardInterrupt:
+        future.cancel()
+        future.result()
+        batcher.stop()
+        subscriber.close()
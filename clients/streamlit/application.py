@@ -1,4 +1,5 @@
 import json
+import time
 
 import streamlit as st
 import altair as alt
@@ -15,6 +16,9 @@ from google.cloud import bigquery
 
 from PIL import Image
 
+import rollup
+import tables
+
 client = bigquery.Client()
 
 # load data index
@@ -24,9 +28,18 @@ client = bigquery.Client()
 def fetch(query):
     return client.query(query).to_dataframe()
 
-# website
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def get_cache():
+    # kept across reruns, one entry per gateway and query
+
+    return tables.Cache(ttl=60)
+
+# website, set_page_config is the first streamlit command
 
 st.set_page_config(page_title='Stargaze Follower')
+
+cache = get_cache()
+
 st.markdown('''
     <style>
       .reportview-container .main .block-container {
@@ -44,19 +57,45 @@ st.markdown('# Stargaze Follower')
 
 # generate
 
-query = '''
-    SELECT
-        *
-    FROM
-        `danarchy-io.stargaze.sensor`
-    ORDER BY
-        date DESC
-    limit 1
-'''
+# latest reading of every sensor, each gateway queried in parallel
+
+pairs = cache.get(('devices',), lambda: tables.devices(client))
+pairs = pairs or [(tables.gateway, tables.device)]
+
+latest = tables.latest_fleet(client, pairs, cache)
+
+df = pd.DataFrame([dict(row.items()) for row in latest.values() if row])
 
-df = fetch(query)
+st.dataframe(df.set_index(['gateway', 'device']) if len(df) else df)
+
+# history, read from the coarsest rollup that has the resolution
+
+ranges = {
+    'hour' : timedelta(hours=1),
+    'day' : timedelta(days=1),
+    'week' : timedelta(weeks=1),
+    'month' : timedelta(days=30),
+    'year' : timedelta(days=365),
+}
+
+gateway = st.selectbox('gateway', sorted(set(g for g, _ in pairs)))
+period = st.selectbox('history', list(ranges), index=1)
+
+# the end is rounded to a minute, so reruns hit the cache
+
+end = int(time.time()) // 60 * 60
+start = end - int(ranges[period].total_seconds())
+
+history = cache.get(
+    ('history', gateway, start, end),
+    lambda: rollup.query(client, start, end, gateway=gateway)
+)
+history = history.assign(date=pd.to_datetime(history['date'], unit='s'))
 
-st.dataframe(df.T)
+for name in ('temperature_avg', 'humidity_avg'):
+    st.line_chart(
+        history.pivot(index='date', columns='device', values=name)
+    )
 
 #st.image('https://storage.cloud.google.com/danarchy-io/iotcore/images/last.jpg')
 
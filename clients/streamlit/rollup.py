@@ -0,0 +1 @@
+../pubsub-reader/rollup.py
\ No newline at end of file
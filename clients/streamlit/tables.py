@@ -0,0 +1 @@
+../pubsub-reader/tables.py
\ No newline at end of file
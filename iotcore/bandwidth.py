@@ -0,0 +1,165 @@
+"""
+Uplink bandwidth scheduler.
+
+A total token bucket caps the uplink, each traffic class has its own
+bucket capped to a share of the total. Classes are served in priority
+order, a class waits while a higher priority class is waiting, so images
+only use whatever capacity telemetry and state leave.
+
+  bandwidth = Bandwidth(total=32 * 1024)
+  bandwidth.acquire('telemetry', len(payload))
+  requests.put(url, data=bandwidth.reader('images', data))
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+# classes, in priority order, and their share of the total
+
+classes = OrderedDict([
+    ('telemetry', 0.2),
+    ('state', 0.1),
+    ('images', 1.0),
+])
+
+class TokenBucket:
+
+    def __init__(self, rate=0, burst=None):
+        self.configure(rate, burst)
+        self.tokens = self.burst
+        self.ts = time.monotonic()
+
+    def configure(self, rate, burst=None):
+        # rate in bytes per second, 0 is unlimited, burst defaults to one
+        # second worth of tokens
+
+        self.rate = rate
+        self.burst = burst or rate
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.ts) * self.rate
+            )
+        self.ts = now
+
+    def ready(self, nbytes):
+        return not self.rate or self.tokens >= min(nbytes, self.burst)
+
+    def delay(self, nbytes):
+        if self.ready(nbytes):
+            return 0
+        return (min(nbytes, self.burst) - self.tokens) / self.rate
+
+    def consume(self, nbytes):
+        if self.rate:
+            self.tokens -= nbytes
+
+class Bandwidth:
+
+    def __init__(self, total=0, shares=None):
+        self.condition = threading.Condition()
+        self.total = TokenBucket()
+        self.buckets = OrderedDict((name, TokenBucket()) for name in classes)
+        self.waiting = {name : 0 for name in classes}
+        self.paused = {name : False for name in classes}
+        self.disabled = {name : False for name in classes}
+        self.sent = {name : 0 for name in classes}
+        self.configure(total, shares)
+
+    def configure(self, total, shares=None):
+        # with a total, a share of 0 disables the class, a rate of 0 would be
+        # unlimited, other shares are at least a byte per second
+
+        shares = dict(classes, **(shares or dict()))
+        with self.condition:
+            self.total.configure(total)
+            for name, bucket in self.buckets.items():
+                self.disabled[name] = bool(total) and not shares[name]
+                bucket.configure(max(int(total * shares[name]), 1) if total else 0)
+            self.condition.notify_all()
+
+    def pause(self, name):
+        with self.condition:
+            self.paused[name] = True
+
+    def resume(self, name):
+        with self.condition:
+            self.paused[name] = False
+            self.condition.notify_all()
+
+    def acquire(self, name, nbytes, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        higher = list(self.buckets)[:list(self.buckets).index(name)]
+        bucket = self.buckets[name]
+
+        with self.condition:
+            self.waiting[name] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.total.refill(now)
+                    bucket.refill(now)
+
+                    blocked = self.paused[name] or self.disabled[name] or any(
+                        self.waiting[other] for other in higher
+                    )
+
+                    if not blocked and bucket.ready(nbytes) and self.total.ready(nbytes):
+                        bucket.consume(nbytes)
+                        self.total.consume(nbytes)
+                        self.sent[name] += nbytes
+                        return True
+
+                    # blocked classes are woken up by notify_all
+
+                    delay = 1.0 if blocked else max(
+                        bucket.delay(nbytes), self.total.delay(nbytes)
+                    )
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        delay = min(delay, deadline - now)
+
+                    self.condition.wait(timeout=delay)
+            finally:
+                self.waiting[name] -= 1
+                self.condition.notify_all()
+
+    def reader(self, name, data, chunk_size=8 * 1024):
+        return ThrottledReader(self, name, data, chunk_size)
+
+class ThrottledReader:
+    # file-like body for requests, http.client reads it in blocksize pieces
+    # so tokens are acquired while the upload is in flight, and pausing the
+    # class pauses the upload
+
+    def __init__(self, bandwidth, name, data, chunk_size):
+        self.bandwidth = bandwidth
+        self.name = name
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def __len__(self):
+        return len(self.data) - self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+
+        # a class disabled while the upload is in flight aborts it, a
+        # paused one keeps it waiting
+
+        chunk = bytes(self.data[self.position:self.position + size])
+        for offset in range(0, len(chunk), self.chunk_size):
+            while not self.bandwidth.acquire(
+                self.name, min(self.chunk_size, len(chunk) - offset), timeout=1
+            ):
+                if self.bandwidth.disabled[self.name]:
+                    raise IOError('{} disabled'.format(self.name))
+        self.position += len(chunk)
+
+        return chunk
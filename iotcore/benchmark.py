@@ -0,0 +1,165 @@
+"""
+Startup benchmark, records the import cost of each subsystem and the agent
+time to first publish, failing when a budget is exceeded.
+
+  python benchmark.py --budget iotcore=300 --budget sensor=50
+  python benchmark.py --agent-log /var/log/iotcore.log --budget publish=30000
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import time
+import json
+import pathlib
+import argparse
+import datetime
+import subprocess
+
+basepath = pathlib.Path(__file__).resolve().absolute().parent
+
+# modules, the agent and the sensor process must stay cheap to import, the
+# rest are imported lazily by the subsystems using them
+
+modules = [
+    'iotcore',
+    'sensor',
+    'paho.mqtt.client',
+    'jwt',
+    'requests',
+    'google.cloud.storage',
+    'cv2',
+    'Adafruit_DHT',
+]
+
+# helpers
+
+def import_time(module):
+    # python -X importtime reports self and cumulative microseconds per
+    # imported module, the last line is the module itself
+
+    start = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        cwd=basepath.as_posix(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    wall = time.monotonic() - start
+
+    if process.returncode != 0:
+        return None
+
+    cumulative = 0
+    imported = 0
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if not match:
+            continue
+        imported += 1
+        if match.group(4) == module:
+            cumulative = int(match.group(2))
+
+    return {
+        'ms' : round(cumulative / 1000, 1),
+        'wall_ms' : round(wall * 1000, 1),
+        'modules' : imported,
+    }
+
+def first_publish(path):
+    # the agent logs 'first publish 1.234s after startup'
+
+    seconds = None
+    with open(path) as file:
+        for line in file:
+            match = re.search(r'first publish ([\d.]+)s after startup', line)
+            if match:
+                seconds = float(match.group(1))
+
+    return seconds
+
+def parse_budget(value):
+    name, _, ms = value.partition('=')
+    return name, float(ms)
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--module',
+        help='modules to measure, defaults to all the agent subsystems',
+        action='append',
+        dest='modules',
+    )
+
+    parser.add_argument(
+        '--budget',
+        help='maximum milliseconds, publish for the time to first publish',
+        metavar='iotcore=300',
+        action='append',
+        type=parse_budget,
+        default=[]
+    )
+
+    parser.add_argument(
+        '--agent-log',
+        help='agent log file to read the time to first publish from',
+        metavar='/var/log/iotcore.log',
+    )
+
+    parser.add_argument(
+        '--output',
+        help='append the results as a json line, to track regressions',
+        metavar='startup.jsonl',
+    )
+
+    args = parser.parse_args()
+
+    results = {
+        'date' : str(datetime.datetime.now(datetime.timezone.utc)),
+        'python' : sys.version.split()[0],
+        'imports' : dict(),
+    }
+
+    for module in args.modules or modules:
+        result = import_time(module)
+        results['imports'][module] = result
+        if result:
+            print('{:24} {:>9.1f} ms {:>9.1f} ms wall {:>5} modules'.format(
+                module, result['ms'], result['wall_ms'], result['modules']
+            ))
+        else:
+            print('{:24} {:>12}'.format(module, 'missing'))
+
+    if args.agent_log:
+        seconds = first_publish(args.agent_log)
+        results['publish'] = seconds
+        print('{:24} {:>9} ms'.format(
+            'publish', 'missing' if seconds is None else round(seconds * 1000, 1)
+        ))
+
+    if args.output:
+        with open(args.output, 'a') as file:
+            file.write(json.dumps(results) + os.linesep)
+
+    exceeded = list()
+    for name, budget in args.budget:
+        if name == 'publish':
+            value = results.get('publish')
+            value = None if value is None else value * 1000
+        else:
+            value = (results['imports'].get(name) or {}).get('ms')
+        if value is not None and value > budget:
+            exceeded.append('{} {:.1f} ms > {:.1f} ms'.format(name, value, budget))
+
+    if exceeded:
+        print('budget exceeded => {}'.format(', '.join(exceeded)))
+        sys.exit(1)
@@ -0,0 +1,108 @@
+"""
+Camera capture, one process per camera, started from the forkserver.
+
+Capture and jpeg encoding happen in the camera process, frames are handed
+to the uploader through a double buffer in shared memory, only the slot
+index, sequence, length and date cross the lock, frames are never
+pickled. Each camera has its own capture event.
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FrameBuffer:
+
+    def __init__(self, context, size):
+        # two slots, the camera writes the one that isn't the latest
+
+        self.size = size
+        self.slots = [context.RawArray('B', size) for _ in range(2)]
+        self.meta = context.RawArray('q', 4)
+        self.lock = context.Lock()
+        self.ready = context.Event()
+
+    def put(self, data, date):
+        # called from the camera process, date is epoch milliseconds
+
+        if len(data) > self.size:
+            raise ValueError('frame is {} bytes, buffer is {}'.format(
+                len(data), self.size
+            ))
+
+        slot = 1 - self.meta[0] if self.meta[1] else 0
+        memoryview(self.slots[slot]).cast('B')[:len(data)] = data
+
+        with self.lock:
+            self.meta[0] = slot
+            self.meta[1] += 1
+            self.meta[2] = len(data)
+            self.meta[3] = date
+
+        self.ready.set()
+
+    def get(self, timeout=None):
+        # returns (sequence, date, jpeg) or None on timeout
+
+        if not self.ready.wait(timeout=timeout):
+            return None
+
+        with self.lock:
+            self.ready.clear()
+            slot, sequence, length, date = self.meta[:]
+            data = bytes(memoryview(self.slots[slot]).cast('B')[:length])
+
+        return sequence, date, data
+
+class OpenCV:
+    # captures from /dev/video{index}, returns jpeg bytes
+
+    def __init__(self, index):
+        import cv2
+
+        self.cv2 = cv2
+        self.camera = cv2.VideoCapture(index)
+
+    def resolution(self, width, height):
+        self.camera.set(self.cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.camera.set(self.cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    def capture(self):
+        value, image = self.camera.read()
+        if not value:
+            raise RuntimeError('no frame from the camera')
+        value, image = self.cv2.imencode('.jpg', image)
+        return image.tobytes()
+
+def thread_loop_camera(
+    index, buffer, width, height, interval, capture, backend, clock, heartbeat
+):
+    camera = backend(index)
+    resolution = None
+
+    while True:
+        heartbeat.value = time.monotonic()
+        since = clock.monotonic()
+
+        if resolution != (width.value, height.value):
+            resolution = (width.value, height.value)
+            camera.resolution(*resolution)
+            logger.info('camera %s resolution set to %sx%s', index, *resolution)
+
+        try:
+            buffer.put(camera.capture(), int(clock.time() * 1000))
+        except Exception:
+            logger.exception('while capturing from camera %s', index)
+
+        # capture is set for an immediate capture, the camera's own, cleared
+        # as soon as it is seen so a trigger during the capture isn't lost
+
+        while True:
+            heartbeat.value = time.monotonic()
+            remaining = interval.value - (clock.monotonic() - since)
+            if remaining <= 0:
+                break
+            if clock.wait(capture, timeout=min(remaining, 1)):
+                capture.clear()
+                break
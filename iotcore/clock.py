@@ -0,0 +1,48 @@
+"""
+Clocks for the agent loops, the system clock, and an accelerated clock
+to run simulated days in minutes, see simulation.py.
+
+Both are picklable, so they can be passed to the forked processes, the
+accelerated clock is anchored to the system wide monotonic clock so all
+the processes agree on the simulated time.
+"""
+
+import time
+
+class Clock:
+
+    speed = 1
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout=timeout)
+
+class AcceleratedClock(Clock):
+
+    def __init__(self, speed, origin=None):
+        self.speed = speed
+        self.origin = time.time() if origin is None else origin
+        self.start = time.monotonic()
+
+    def elapsed(self):
+        return (time.monotonic() - self.start) * self.speed
+
+    def time(self):
+        return self.origin + self.elapsed()
+
+    def monotonic(self):
+        return self.start + self.elapsed()
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout=None if timeout is None else timeout / self.speed)
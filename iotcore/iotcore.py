@@ -14,61 +14,84 @@ import sys
 if sys.version_info[0] < 3: 
     raise Exception('python >= 3.x supported')
 
-import os
 import time
+
+startup_ts = time.monotonic()
+
+import os
+import atexit
 import random
 import datetime
 import logging
 import argparse
 import threading
-import requests
 import tempfile
 import pathlib
 import uuid
 import json
+import signal
+import dataclasses
+import importlib.util
+import multiprocessing
 
 from collections import OrderedDict
-from multiprocessing import Process
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe
 from multiprocessing.connection import Listener
-from multiprocessing.connection import Client
+from multiprocessing.connection import wait
 
-logging.basicConfig(
-    format='%(asctime)-15s %(name)s [%(levelname)s] %(threadName)s:%(funcName)s:%(lineno)d : %(message)s'
-)
+import camera
+import logs
+import sensor
+import telemetry
+import timeseries
+
+from bandwidth import Bandwidth
+from clock import Clock
+from profiler import Profiler
+
+# replaced by the logs pipeline in __main__, the forked processes keep it
+
+logging.basicConfig(format=logs.log_format)
+
+logs_pipeline = None
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 basepath = pathlib.Path(__file__).resolve().absolute().parent
 
-# check imports
+# heavy imports are deferred to the subsystems using them, mqtt is
+# imported by build_client()
 
-try:
-    import pytz
-    import jwt
-    import ssl
-    import paho.mqtt.client as mqtt
+requirements = ['jwt', 'paho.mqtt.client', 'google.cloud.storage']
 
-    from google.cloud import storage
-except:
-    logging.exception(
-        'missing requirements, install %s', 
-        basepath.joinpath('requirements.txt').as_posix()
-    )
-    sys.exit(1)
+mqtt = None
+
+# processes are forked from a forkserver that only imports this module and
+# the sensor loop, not the modules imported afterwards by the agent
+
+processes = multiprocessing.get_context('forkserver')
+processes.set_forkserver_preload(['__main__', 'sensor', 'camera'])
 
 # timezone
 
-tz = pytz.timezone('America/Santiago')
-tz = pytz.timezone('UTC')
+tz = datetime.timezone.utc
+
+# clock, the loops sleep and timestamp through it, simulation.py replaces it
+# with an accelerated clock
 
-# mqtt
+clock = Clock()
+
+# mqtt, the identity of this gateway, replaced by --gateway-config
 
 connection_project = 'danarchy-io'
 connection_region = 'us-central1'
 connection_registry = 'raspberry'
 connection_gateway = 'default'
 connection_key = None
+connection_ca_certs = None
 connection_devices = None
 connection_publish_mid = None
 
@@ -79,11 +102,23 @@ connection_timeout = 20
 connection_connected = False
 connection_connected_ts = None
 connection_expire = None
+connection_persistent = False
+
+# reconnection, full jitter exponential backoff
+
+connection_backoff = 0.5
+connection_backoff_max = 60
+connection_jwt_ts = None
+connection_attempts = 0
+connection_lost_ts = None
+connection_recoveries = deque(maxlen=100)
+connection_first_publish = None
 
 # events
 
 connection_event_connected = threading.Event()
 connection_event_disconnected = threading.Event()
+connection_event_stop = threading.Event()
 
 # locks
 
@@ -95,15 +130,163 @@ lock_attach = threading.RLock()
 # threads
 
 thread_connection = None
-thread_gateway_state = None
-thread_sensor_publish = None
-thread_sensor_listener = None
-thread_image_events = None
+thread_supervisor = None
+
+# supervisor, workers are restarted in-place with exponential backoff,
+# giving up on a worker once it exceeds the restart rate
+
+supervisor_workers = OrderedDict()
+supervisor_reader, supervisor_writer = Pipe(duplex=False)
+supervisor_lock = threading.Lock()
+supervisor_backoff = 0.01
+supervisor_backoff_max = 60
+supervisor_stable = 60
+supervisor_restarts_max = 10
+supervisor_restarts_window = 600
 
 # dicts
 
 connection_publish_mid = None
 
+# offline queue, readings that couldn't be published
+
+publish_queue = deque(maxlen=10000)
+
+# commands, handlers are keyed by the commands/# subtopic
+
+commands_handlers = dict()
+commands_pool = None
+commands_workers = 2
+commands_timeout = 30
+
+# configuration, the document received on /devices/{device}/config, e.g.
+# {"version": 2, "image_interval": 300, "image_width": 640}, the fields
+# missing are the defaults, the sensor fields come from the document of the
+# first sensor that has one, or the gateway's, the others from the gateway's
+
+@dataclasses.dataclass(frozen=True)
+class Configuration:
+    version: int = 0
+    sensor_interval: float = dataclasses.field(
+        default=3.0, metadata={'min' : 1, 'owner' : 'sensor'}
+    )
+    sensor_interval_max: float = dataclasses.field(
+        default=60.0, metadata={'min' : 1, 'owner' : 'sensor'}
+    )
+    image_interval: float = dataclasses.field(
+        default=60.0, metadata={'min' : 5}
+    )
+    image_width: int = dataclasses.field(
+        default=1280, metadata={'min' : 160}
+    )
+    image_height: int = dataclasses.field(
+        default=720, metadata={'min' : 120}
+    )
+    ping_interval: float = dataclasses.field(
+        default=300.0, metadata={'min' : 10}
+    )
+    bandwidth: int = dataclasses.field(
+        default=0, metadata={'min' : 0}
+    )
+    bandwidth_telemetry: float = dataclasses.field(
+        default=0.2, metadata={'min' : 0, 'max' : 1}
+    )
+    bandwidth_state: float = dataclasses.field(
+        default=0.1, metadata={'min' : 0, 'max' : 1}
+    )
+    bandwidth_images: float = dataclasses.field(
+        default=1.0, metadata={'min' : 0, 'max' : 1}
+    )
+
+    @classmethod
+    def parse(cls, payload):
+        # the document is the whole desired state, missing fields are the
+        # defaults, not the running values
+
+        document = json.loads(payload)
+        if not isinstance(document, dict):
+            raise ValueError('configuration must be an object')
+        if 'version' not in document:
+            raise ValueError('configuration must have a version')
+
+        fields = {field.name : field for field in dataclasses.fields(cls)}
+
+        unknown = set(document) - set(fields)
+        if unknown:
+            raise ValueError('unknown fields {}'.format(sorted(unknown)))
+
+        values = dict()
+        for name, value in document.items():
+            field = fields[name]
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError('{} must be a number'.format(name))
+            if field.type is int and value != int(value):
+                raise ValueError('{} must be an integer'.format(name))
+            if value < field.metadata.get('min', 0):
+                raise ValueError('{} must be >= {}'.format(
+                    name, field.metadata.get('min', 0)
+                ))
+            if 'max' in field.metadata and value > field.metadata['max']:
+                raise ValueError('{} must be <= {}'.format(
+                    name, field.metadata['max']
+                ))
+            values[name] = field.type(value)
+
+        return cls(**values)
+
+configuration = Configuration()
+configuration_versions = dict()
+configuration_documents = dict()
+
+# sensors, by device id, one process each, the sampling interval is shared
+# with the processes
+
+sensors = OrderedDict([('sensor', sensor.DHT22(pin=4))])
+sensor_interval = processes.Value('d', configuration.sensor_interval)
+sensor_interval_max = processes.Value('d', configuration.sensor_interval_max)
+
+# uplink, bandwidth in bytes per second, 0 is unlimited
+
+bandwidth = Bandwidth()
+bandwidth_timeout = 5
+
+# local time series of readings, one per sensor, and its http endpoint
+
+stores = OrderedDict()
+store_host = 'localhost'
+store_port = None
+
+# cameras, one capture process and one uploader thread per camera, the
+# configuration and the capture event are shared with the processes
+
+cameras = [0]
+camera_backend = camera.OpenCV
+camera_buffers = dict()
+camera_buffer_size = 4 * 1024 * 1024
+camera_width = processes.Value('i', configuration.image_width)
+camera_height = processes.Value('i', configuration.image_height)
+camera_interval = processes.Value('d', configuration.image_interval)
+camera_captures = dict()
+
+# resource profiler, off unless --profile, the profile command or SIGUSR2
+
+profiler = Profiler(
+    os.path.join(tempfile.gettempdir(), 'iotcore.profile'),
+    children=lambda: {
+        name : worker['worker'].pid
+        for name, worker in supervisor_workers.items()
+        if worker['process'] and worker['worker'] and worker['worker'].is_alive()
+    }
+)
+
+# images, uploaded to gcs unless replaced
+
+image_bucket = 'danarchy-io'
+image_prefix = 'iotcore/images'
+image_storage = None
+image_event_uploaded = threading.Event()
+image_last_blob = None
+
 # client
 
 client_host = 'localhost'
@@ -112,7 +295,26 @@ client_passwd = uuid.uuid4().hex
 
 # helper functions
 
+def check_requirements():
+    missing = list()
+    for name in requirements:
+        try:
+            if not importlib.util.find_spec(name):
+                missing.append(name)
+        except ImportError:
+            missing.append(name)
+
+    if missing:
+        logger.error(
+            'missing requirements %s, install %s',
+            missing,
+            basepath.joinpath('requirements.txt').as_posix()
+        )
+        sys.exit(1)
+
 def create_jwt(project_id, private_key_file, private_key_expire, algorithm):
+    import jwt
+
     iat = datetime.datetime.utcnow()
     exp = iat + datetime.timedelta(seconds=private_key_expire + 120)
     
@@ -133,66 +335,628 @@ def create_jwt(project_id, private_key_file, private_key_expire, algorithm):
 
     return jwt.encode(token, private_key_str, algorithm=algorithm)
 
+def now():
+    return datetime.datetime.fromtimestamp(clock.time(), tz)
+
 def is_valid_file(parser, arg):
     if not os.path.exists(arg):
         parser.error('%s'.format(arg))
     else:
         return arg
 
+# fleet
+
+gateway_fields = [
+    'project', 'region', 'registry', 'gateway', 'bucket', 'images',
+    'sensors', 'cameras'
+]
+
+def load_gateway(path):
+    # identity and devices of this gateway, e.g.
+    # {"gateway": "greenhouse-2", "sensors": {"sensor-2": {"pin": 4}}}
+    # missing fields keep their defaults, images defaults to a prefix per
+    # gateway
+
+    global connection_project
+    global connection_region
+    global connection_registry
+    global connection_gateway
+    global image_bucket
+    global image_prefix
+    global sensors
+    global cameras
+
+    with open(path) as file:
+        document = json.load(file)
+
+    if not isinstance(document, dict):
+        raise ValueError('{} must be an object'.format(path))
+
+    unknown = set(document) - set(gateway_fields)
+    if unknown:
+        raise ValueError('unknown fields {} in {}'.format(sorted(unknown), path))
+
+    connection_project = document.get('project', connection_project)
+    connection_region = document.get('region', connection_region)
+    connection_registry = document.get('registry', connection_registry)
+    connection_gateway = document.get('gateway', connection_gateway)
+    image_bucket = document.get('bucket', image_bucket)
+
+    if connection_gateway != 'default':
+        image_prefix = 'iotcore/{}/images'.format(connection_gateway)
+    image_prefix = document.get('images', image_prefix)
+
+    if 'sensors' in document:
+        if not document['sensors']:
+            raise ValueError('no sensors in {}'.format(path))
+        sensors = OrderedDict(
+            (device, sensor.DHT22(**options))
+            for device, options in document['sensors'].items()
+        )
+
+    cameras = [int(index) for index in document.get('cameras', cameras)]
+
+def build_devices():
+    # gateway and sensors, with their subscriptions
+
+    devices = OrderedDict()
+
+    devices[connection_gateway] = {
+        'config' : {
+            'qos' : 1,
+            'callback' : callback_config_gateway
+        },
+        'errors' : {
+            'qos' : 0,
+            'callback' : callback_error_gateway
+        },
+        'commands/#' : {
+            'qos' : 0,
+            'callback' : callback_command_gateway
+        },
+    }
+
+    for device in sensors:
+        devices[device] = {
+            'config' : {
+                'qos' : 1,
+                'callback' : callback_config_sensor
+            },
+            'errors' : {
+                'qos' : 0,
+                'callback' : callback_error_sensor
+            },
+            'commands/#' : {
+                'qos' : 0,
+                'callback' : callback_command_sensor
+            },
+        }
+
+    return devices
+
 def publish(topic, payload, qos=0):
+    # events are telemetry, anything else (state, attach, detach) is state,
+    # waits for tokens but publishes anyway once the timeout expires, the
+    # callbacks on the network thread don't wait at all
+
+    name = 'telemetry' if topic.endswith('/events') else 'state'
+    timeout = bandwidth_timeout
+    if threading.current_thread() is thread_connection:
+        timeout = 0
+    if not bandwidth.acquire(name, len(topic) + len(payload), timeout):
+        logger.warning('no bandwidth for %s on %s', name, topic)
+
     with lock_connection:
         try:
             if connection_connected:
                 _, mid = connection_client.publish(topic, payload, qos=qos)
-                logger.info(
-                    'published on {}, mid {}, payload = {}'.format(
-                        topic, mid, payload
-                    )
+                logger.debug(
+                    'published on %s, mid %s, payload = %s', topic, mid, payload
                 )
                 return True, mid
             else:
                 logger.warning(
-                    'connected = {}, error publishing on {}, payload = {}'.format(
-                        connection_connected, topic, payload
-                    )
+                    'connected = %s, error publishing on %s, payload = %s',
+                    connection_connected, topic, payload
                 )
                 return False, -1
         except:
             logger.exception(
-                'connected = {}, error publishing on {}, payload = {}'.format(
-                    connection_connected, topic, payload
-                )
+                'connected = %s, error publishing on %s, payload = %s',
+                connection_connected, topic, payload
             )
             return False, -1
 
+# commands
+
+def command(name, timeout=None):
+    def decorator(function):
+        with lock_commands:
+            commands_handlers[name] = (function, timeout or commands_timeout)
+        return function
+    return decorator
+
+def command_state(device, name, status, result=None):
+    payload = json.dumps({
+        'command' : name,
+        'status' : status,
+        'result' : result,
+        'date' : str(now()),
+    })
+    return publish('/devices/{}/state'.format(device), payload, qos=1)
+
+def command_dispatch(device, topic, payload):
+    global commands_pool
+
+    # /devices/{device}/commands/{subtopic}, runs the handler in the pool
+    # so nothing blocks the paho network thread
+
+    name = topic.split('/commands', 1)[-1].strip('/')
+
+    with lock_commands:
+        if not commands_pool:
+            commands_pool = ThreadPoolExecutor(
+                max_workers=commands_workers,
+                thread_name_prefix='thread_command'
+            )
+        handler = commands_handlers.get(name)
+
+    if not handler:
+        logger.warning('device \'%s\' => unknown command \'%s\'', device, name)
+        command_state(device, name, 'unknown')
+        return None
+
+    function, timeout = handler
+    reported = threading.Lock()
+
+    # whatever comes first, the result or the timeout, is reported, a
+    # command still queued after timeout is cancelled, a running one has
+    # timeout from its start
+
+    def report(status, result=None):
+        if not reported.acquire(blocking=False):
+            return False
+        logger.info(
+            'device \'%s\' => command \'%s\' %s', device, name, status
+        )
+        command_state(device, name, status, result)
+        return True
+
+    def expire():
+        if future.cancel():
+            report('cancelled')
+
+    def run():
+        queued.cancel()
+        timer = threading.Timer(timeout, report, args=('timeout',))
+        timer.daemon = True
+        timer.start()
+        try:
+            return function(device, payload)
+        finally:
+            timer.cancel()
+
+    def done(future):
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.exception('while running command \'%s\'', name)
+            report('error', str(e))
+            return
+        if not report('ok', result):
+            logger.warning(
+                'device \'%s\' => command \'%s\' done after its timeout',
+                device, name
+            )
+
+    queued = threading.Timer(timeout, expire)
+    queued.daemon = True
+
+    future = commands_pool.submit(run)
+    queued.start()
+    future.add_done_callback(done)
+
+    return future
+
+# supervisor
+
+def supervisor_register(name, target, args=(), process=False, timeout=None):
+    # timeout is the maximum age in seconds of the last heartbeat, or a
+    # callable returning it, threads can't be killed so a stale thread is
+    # only reported, a stale process is terminated and restarted
+
+    with supervisor_lock:
+        supervisor_workers[name] = {
+            'name' : name,
+            'target' : target,
+            'args' : args,
+            'process' : process,
+            'timeout' : timeout,
+            'worker' : None,
+            'heartbeat' : processes.Value('d', 0.0) if process else 0.0,
+            'started' : None,
+            'stale' : False,
+            'failures' : 0,
+            'restarts' : deque(),
+            'next_start' : time.monotonic(),
+            'failed' : False,
+        }
+
+def supervisor_heartbeat(name):
+    worker = supervisor_workers.get(name)
+    if worker:
+        worker['heartbeat'] = time.monotonic()
+
+def supervisor_run(name, target, args):
+    try:
+        target(*args)
+        logger.warning('worker \'%s\' exited', name)
+    except:
+        logger.exception('worker \'%s\' died', name)
+    finally:
+        # wakes up the supervisor right away
+        with supervisor_lock:
+            supervisor_writer.send(name)
+
+def supervisor_start(worker):
+    name = worker['name']
+
+    if worker['process']:
+        worker['heartbeat'].value = time.monotonic()
+        instance = processes.Process(
+            name=name,
+            target=worker['target'],
+            args=worker['args'] + (worker['heartbeat'],)
+        )
+    else:
+        worker['heartbeat'] = time.monotonic()
+        instance = threading.Thread(
+            name=name,
+            target=supervisor_run,
+            args=(name, worker['target'], worker['args'])
+        )
+
+    instance.start()
+
+    worker['worker'] = instance
+    worker['started'] = time.monotonic()
+    worker['stale'] = False
+    worker['next_start'] = None
+
+    logger.info('worker \'%s\' started', name)
+
+def supervisor_check(worker, now):
+    name = worker['name']
+    instance = worker['worker']
+
+    if worker['failed']:
+        return
+
+    if instance and instance.is_alive():
+        if worker['failures'] and now - worker['started'] > supervisor_stable:
+            worker['failures'] = 0
+
+        timeout = worker['timeout']
+        if callable(timeout):
+            timeout = timeout()
+
+        heartbeat = worker['heartbeat']
+        if worker['process']:
+            heartbeat = heartbeat.value
+
+        if timeout and now - heartbeat > timeout:
+            if worker['process']:
+                logger.error(
+                    'worker \'%s\' heartbeat is %.1fs old, terminating',
+                    name, now - heartbeat
+                )
+                instance.terminate()
+                instance.join(timeout=5)
+            elif not worker['stale']:
+                logger.error(
+                    'worker \'%s\' heartbeat is %.1fs old, stuck?',
+                    name, now - heartbeat
+                )
+                worker['stale'] = True
+            return
+
+        worker['stale'] = False
+        return
+
+    if worker['next_start'] is None:
+        if worker['process']:
+            instance.join(timeout=0)
+            logger.error(
+                'worker \'%s\' died with exitcode %s', name, instance.exitcode
+            )
+
+        restarts = worker['restarts']
+        restarts.append(now)
+        while restarts and now - restarts[0] > supervisor_restarts_window:
+            restarts.popleft()
+
+        if len(restarts) > supervisor_restarts_max:
+            logger.critical(
+                'worker \'%s\' restarted %s times in %ss, giving up',
+                name, len(restarts) - 1, supervisor_restarts_window
+            )
+            worker['failed'] = True
+            return
+
+        delay = min(
+            supervisor_backoff * 2 ** worker['failures'], 
+            supervisor_backoff_max
+        )
+        worker['failures'] += 1
+        worker['next_start'] = now + delay
+
+        logger.info('worker \'%s\' restarting in %.2fs', name, delay)
+
+    if now >= worker['next_start']:
+        supervisor_start(worker)
+
+def thread_loop_supervisor():
+    while True:
+        now = time.monotonic()
+        timeout = 1.0
+
+        with supervisor_lock:
+            workers = list(supervisor_workers.values())
+
+        # wakes up when a thread exits, a process dies, or for the next
+        # scheduled restart and heartbeat check
+
+        waitables = [supervisor_reader]
+        for worker in workers:
+            if worker['next_start'] is not None:
+                timeout = min(timeout, max(worker['next_start'] - now, 0))
+            elif worker['process'] and worker['worker'].is_alive():
+                waitables.append(worker['worker'].sentinel)
+
+        wait(waitables, timeout=timeout)
+
+        while supervisor_reader.poll():
+            supervisor_reader.recv()
+
+        now = time.monotonic()
+        for worker in workers:
+            try:
+                supervisor_check(worker, now)
+            except:
+                logger.exception('while checking worker \'%s\'', worker['name'])
+
+# configuration
+
+def configuration_apply(update):
+    global configuration
+
+    with lock_configuration:
+        previous = configuration
+        configuration = update
+        sensor_interval.value = configuration.sensor_interval
+        sensor_interval_max.value = configuration.sensor_interval_max
+        camera_width.value = configuration.image_width
+        camera_height.value = configuration.image_height
+        camera_interval.value = configuration.image_interval
+        bandwidth.configure(configuration.bandwidth, {
+            'telemetry' : configuration.bandwidth_telemetry,
+            'state' : configuration.bandwidth_state,
+            'images' : configuration.bandwidth_images,
+        })
+
+    changes = {
+        k:v for k,v in dataclasses.asdict(configuration).items() 
+        if getattr(previous, k) != v
+    }
+    logger.info('configuration applied => %s', changes)
+
+    return configuration
+
+def configuration_merge():
+    # iot core delivers the document of every device on each subscribe, the
+    # result doesn't depend on their order
+
+    gateway = configuration_documents.get(connection_gateway, Configuration())
+    owner = next(
+        (configuration_documents[d] for d in sensors if d in configuration_documents),
+        gateway
+    )
+
+    return Configuration(**{
+        field.name : getattr(
+            owner if field.metadata.get('owner') == 'sensor' else gateway,
+            field.name
+        )
+        for field in dataclasses.fields(Configuration)
+    })
+
+def configuration_update(device, payload):
+    # iot core delivers the latest config on every (re)subscribe, an empty
+    # payload means that no configuration has been set for the device
+
+    if not payload.strip():
+        return None
+
+    try:
+        with lock_configuration:
+            update = Configuration.parse(payload)
+            if update.version <= configuration_versions.get(device, -1):
+                logger.info(
+                    'device \'%s\' => configuration version %s already applied',
+                    device, update.version
+                )
+                return None
+            configuration_versions[device] = update.version
+            configuration_documents[device] = update
+            configuration_apply(configuration_merge())
+    except ValueError as e:
+        logger.error('device \'%s\' => invalid configuration, %s', device, e)
+        return None
+
+    publish(
+        '/devices/{}/state'.format(device),
+        json.dumps({'configuration' : update.version}),
+        qos=1
+    )
+
+    return update
+
+def configuration_wait(name, since, event=None):
+    # waits until the configured interval elapses, re-reading it so a new
+    # configuration takes effect without restarting the loop, returns True
+    # if the event was set
+
+    while True:
+        remaining = getattr(configuration, name) - (clock.monotonic() - since)
+        if remaining <= 0:
+            return False
+        if event and clock.wait(event, timeout=min(remaining, 1)):
+            return True
+        if not event:
+            clock.sleep(min(remaining, 1))
+
+def flush_offline():
+    flushed = 0
+    while publish_queue:
+        topic, payload = publish_queue.popleft()
+        success, mid = publish(topic, payload)
+        if not success:
+            publish_queue.appendleft((topic, payload))
+            break
+        flushed += 1
+    return flushed
+
+# command handlers
+
+@command('image', timeout=120)
+def command_image(device, payload):
+    image_event_uploaded.clear()
+    for capture in camera_captures.values():
+        capture.set()
+    if not image_event_uploaded.wait(timeout=110):
+        raise RuntimeError('image not uploaded')
+    return image_last_blob
+
+@command('interval')
+def command_interval(device, payload):
+    interval = float(payload)
+    if interval < 1:
+        raise ValueError('interval {} < 1 second'.format(interval))
+    with lock_configuration:
+        configuration_apply(
+            dataclasses.replace(configuration, sensor_interval=interval)
+        )
+    return interval
+
+@command('upload')
+def command_upload(device, payload):
+    if payload == 'pause':
+        bandwidth.pause('images')
+    elif payload == 'resume':
+        bandwidth.resume('images')
+    else:
+        raise ValueError('upload {}, expected pause or resume'.format(payload))
+    return payload
+
+@command('logs')
+def command_logs(device, payload):
+    if not logs_pipeline or not logs_pipeline.dump_path:
+        raise RuntimeError('no log dump path, see --logdump')
+    path, records = logs_pipeline.dump()
+    return {'path' : path, 'records' : records}
+
+@command('profile', timeout=60)
+def command_profile(device, payload):
+    if payload == 'start':
+        profiler.start()
+    elif payload == 'stop':
+        profiler.stop()
+    elif payload == 'sample':
+        return profiler.sample()
+    else:
+        raise ValueError('profile {} is not start, stop or sample'.format(payload))
+    return {'running' : profiler.running, 'path' : profiler.path}
+
+@command('flush', timeout=60)
+def command_flush(device, payload):
+    flushed = flush_offline()
+    return {'flushed' : flushed, 'queued' : len(publish_queue)}
+
 # defaul mqtt callbacks
 
 def error_str(rc):
     return '{}: {}'.format(rc, mqtt.error_string(rc))
 
-def callback_connect(client, userdata, unused_flags, rc):
+def callback_connect(client, userdata, flags, rc):
     global connection_connected
     global connection_connected_ts
+    global connection_attempts
 
     logger.info('callback_connect => %s', mqtt.connack_string(rc))
 
+    if rc != mqtt.CONNACK_ACCEPTED:
+        return
+
+    connection_attempts = 0
+
+    # with a persistent session the broker keeps the subscriptions
+
+    session = bool(flags.get('session present'))
+
     with lock_connection:
         connection_event_disconnected.clear()
-        connection_connected_ts = datetime.datetime.now(tz)
+        connection_connected_ts = now()
         connection_connected = True
-        setup_devices()
+        setup_devices(subscribe=not session)
         setup_threads()
 
+    if publish_queue:
+        threading.Thread(name='thread_flush', target=flush_offline).start()
+
 def callback_disconnect(client, userdata, rc):
+    global connection_connected
+    global connection_lost_ts
+
     logger.info('callback_disconnect => %s', error_str(rc))
     with lock_connection:
+        connection_connected = False
+        if rc != mqtt.MQTT_ERR_SUCCESS and connection_lost_ts is None:
+            connection_lost_ts = time.monotonic()
         connection_event_disconnected.set()
 
 def callback_subscribe(client, userdata, mid, granted_qos):
     logger.debug('callback_subscribe => mid {}, qos {}'.format(mid, granted_qos))
 
 def callback_publish(client, userdata, mid):
-    pass
+    global connection_lost_ts
+    global connection_first_publish
+
+    if connection_first_publish is None:
+        connection_first_publish = time.monotonic() - startup_ts
+        logger.info('first publish %.3fs after startup', connection_first_publish)
+
+    # time from an unexpected disconnection to the first successful publish
+
+    with lock_connection:
+        if connection_lost_ts is None:
+            return
+        recovery = time.monotonic() - connection_lost_ts
+        connection_lost_ts = None
+        connection_recoveries.append(recovery)
+
+    logger.info('connection recovered in %.3fs', recovery)
+
+    publish(
+        '/devices/{}/state'.format(connection_gateway),
+        json.dumps({
+            'recovery' : round(recovery, 3),
+            'recovery_max' : round(max(connection_recoveries), 3),
+            'recoveries' : len(connection_recoveries),
+        }),
+        qos=1
+    )
 
 def callback_message(client, userdata, message):
     payload = str(message.payload.decode('utf-8'))
@@ -221,7 +985,13 @@ def build_client(
     callback_publish=None,
     callback_subscribe=None,
     callback_message=None,
+    clean_session=True,
 ):
+    global connection_jwt_ts
+    global mqtt
+
+    import ssl
+    import paho.mqtt.client as mqtt
 
     # build client
 
@@ -231,7 +1001,7 @@ def build_client(
 
     logger.info('device client_id is \'%s\'', client_id)
 
-    client = mqtt.Client(client_id=client_id)
+    client = mqtt.Client(client_id=client_id, clean_session=clean_session)
 
     # default callbacks 
 
@@ -260,8 +1030,31 @@ def build_client(
         algorithm
     )
     client.username_pw_set(username=username, password=password)
+    connection_jwt_ts = time.monotonic()
+
+    # tls config
+
+    client.tls_set(
+        ca_certs=download_ca_certs(ca_certs_url),
+        tls_version=ssl.PROTOCOL_TLSv1_2
+    )
+
+    # connect
+
+    logger.info('connecting to %s:%s', mqtt_bridge_hostname, mqtt_bridge_port)
+    retry(lambda: client.connect(mqtt_bridge_hostname, mqtt_bridge_port))
+
+    return client
+
+def download_ca_certs(ca_certs_url):
+    # once per run, every client reuses the file, removed on exit
+
+    global connection_ca_certs
 
-    # download ca_cert
+    import requests
+
+    if connection_ca_certs and os.path.exists(connection_ca_certs):
+        return connection_ca_certs
 
     res = requests.get(ca_certs_url)
     if res.status_code != 200:
@@ -272,165 +1065,257 @@ def build_client(
             )
         )
 
-    ca_certs = tempfile.mkstemp(suffix='.pem')[1]
-    with open(ca_certs, 'w') as file:
+    fd, ca_certs = tempfile.mkstemp(suffix='.pem')
+    with os.fdopen(fd, 'w') as file:
         file.write(res.text)
+    atexit.register(remove_ca_certs, ca_certs)
 
     logger.info('ca_certs from %s is %s', ca_certs_url, ca_certs)
 
-    # tls config
+    connection_ca_certs = ca_certs
+    return ca_certs
 
-    client.tls_set(ca_certs=ca_certs, tls_version=ssl.PROTOCOL_TLSv1_2)
+def remove_ca_certs(ca_certs):
+    try:
+        os.remove(ca_certs)
+    except OSError:
+        pass
 
-    # connect
+def retry(function):
+    # the attempts are counted across calls, a connection refused in the
+    # connack comes after connect() returned, only callback_connect resets
+    # them once the broker accepted
 
-    logger.info('connecting to %s:%s', mqtt_bridge_hostname, mqtt_bridge_port)
-    client.connect(mqtt_bridge_hostname, mqtt_bridge_port)
+    global connection_attempts
 
-    return client
+    while True:
+        if connection_attempts:
+            delay = random.uniform(0, min(
+                connection_backoff * 2 ** (connection_attempts - 1),
+                connection_backoff_max
+            ))
+            logger.warning(
+                'attempt %s, retrying in %.2fs', connection_attempts + 1, delay
+            )
+            if connection_event_stop.wait(timeout=delay):
+                raise ConnectionError('stopped while connecting')
+
+        connection_attempts += 1
+        try:
+            return function()
+        except Exception as e:
+            if connection_event_stop.is_set():
+                raise
+            logger.warning(
+                'attempt %s failed with \'%s\'', connection_attempts, e
+            )
+
+def reconnect(client):
+    # the jwt might have expired while disconnected
+
+    def attempt():
+        global connection_jwt_ts
+
+        if time.monotonic() - connection_jwt_ts > connection_expire:
+            client.username_pw_set(
+                username='unused',
+                password=create_jwt(
+                    connection_project, 
+                    connection_key, 
+                    connection_expire, 
+                    'RS256'
+                )
+            )
+            connection_jwt_ts = time.monotonic()
+        return client.reconnect()
+
+    logger.info('reconnecting...')
+    retry(attempt)
 
 # thread functions
 
 def thread_loop_connection():
-    connection_client.loop_forever()
+    # same as loop_forever, but reconnecting the same client with our own
+    # backoff, until setup_disconnect()
+
+    client = connection_client
+
+    while True:
+        rc = client.loop(timeout=1.0)
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            continue
+        if connection_event_stop.is_set():
+            break
+        try:
+            reconnect(client)
+        except:
+            if not connection_event_stop.is_set():
+                logger.exception('while reconnecting')
+
     logger.info('exiting...')
 
 def thread_loop_gateway_state(topic):
     while True:
-        payload = 'ping {}'.format(str(datetime.datetime.now(tz)))
+        supervisor_heartbeat('thread_gateway_state')
+        since = clock.monotonic()
+        payload = 'ping {}'.format(str(now()))
         success, mid = publish(topic, payload, 0)
-        time.sleep(300)
+        configuration_wait('ping_interval', since)
 
-def thread_loop_sensor_publish(topic):
-    import Adafruit_DHT as adafruit
-
-    conn = Client(
+def thread_loop_sensor_listener():
+    listener = Listener(
         (client_host, client_port), 
         authkey=client_passwd.encode()
     )
 
-    last_h = 0
-    last_t = 0
-
-    limit = 10
-
-    lines = list()
+    # a thread per sensor process, a restarted process reconnects
 
-    first_run = True
-
-    while True:
-        try:
-            h,t = adafruit.read_retry(adafruit.DHT22, 4)
+    try:
+        while True:
+            conn = listener.accept()
+            logger.info('connection accepted from %s', listener.last_accepted)
+
+            threading.Thread(
+                name='thread_sensor_connection',
+                target=thread_loop_sensor_connection,
+                args=(conn, listener.last_accepted),
+                daemon=True
+            ).start()
+    finally:
+        listener.close()
+
+def thread_loop_sensor_connection(conn, address):
+    try:
+        while True:
+            data = conn.recv()
+            logger.debug(data)
 
-            flag_h = 0
-            flag_t = 0
+            try:
+                topic = data['topic']
+                payload = data['payload']
+
+                succes, mid = publish(topic, payload)
+                if not succes:
+                    publish_queue.append((topic, payload))
+
+                # /devices/{device}/events
+                store = stores.get(topic.split('/')[2])
+                if store is not None:
+                    try:
+                        store.append(*telemetry.decode(payload))
+                    except ValueError as e:
+                        logger.warning('reading not stored, %s', e)
+            except Exception:
+                logger.exception('while handling %s from %s', data, address)
+    except (EOFError, OSError):
+        logger.warning('connection closed from %s', address)
+    finally:
+        conn.close()
+
+def open_stores(path):
+    # the first sensor keeps its readings in path, the others in
+    # path.{device}
+
+    for index, device in enumerate(sensors):
+        stores[device] = timeseries.TimeSeries(
+            path if not index else '{}.{}'.format(path, device)
+        )
+    return stores
 
-            if h is None:
-                flag_h = 1
-                h = last_h
+def thread_loop_store_http():
+    server = timeseries.build_server(
+        next(iter(stores.values())), store_host, store_port, stores
+    )
+    logger.info('serving readings on http://%s:%s', store_host, store_port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
-            if t is None:
-                flag_t = 1
-                t = last_t
+class GCSImages:
 
-            if not first_run and abs(h - last_h) >= 5:
-                flag_h = 2
+    def __init__(self, bucket_name):
+        from google.cloud import storage
 
-            if not first_run and abs(t - last_t) >= 5:
-                flag_t = 2
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
 
-            last_h = h
-            last_t = t
-            first_run = False
+    def upload(self, name, data):
+        import requests
 
-            payload = '{},{:.2f},{:.2f},{},{}'.format(
-                str(datetime.datetime.now(tz)),
-                h,
-                t,
-                flag_h,
-                flag_t
-            )
+        # the body is read in small pieces as tokens are available, so
+        # telemetry isn't stuck behind the image
 
-            data = {
-                'topic' : topic,
-                'payload' : payload,
-            }
+        blob = self.bucket.blob(name)
+        session = blob.create_resumable_upload_session(
+            content_type='image/jpeg', size=len(data)
+        )
+        res = requests.put(
+            session, 
+            data=bandwidth.reader('images', data),
+            headers={'Content-Type' : 'image/jpeg'}
+        )
+        res.raise_for_status()
 
-            conn.send(json.dumps(data))
+        return 'gs://{}/{}'.format(self.bucket_name, name)
 
-        except Exception as e:
-            logger.exception('there was an error, check the stacktrace...')
+    def publish(self, name, public_name):
+        self.bucket.copy_blob(
+            self.bucket.blob(name), 
+            self.bucket, 
+            public_name
+        ).blob.make_public()
 
-        time.sleep(3)
-    
-    conn.send('close connection')
-    conn.close()
+def thread_loop_image(index):
+    global image_last_blob
 
-def thread_loop_sensor_listener():
-    listener = Listener(
-        (client_host, client_port), 
-        authkey=client_passwd.encode()
-    )
+    bucket_path = image_prefix
+    if index:
+        bucket_path = '{}/{}'.format(bucket_path, index)
 
-    running = True
-    while running:
-        conn = listener.accept()
-        logger.info('connection accepted from %s', listener.last_accepted)
-        
-        while True:
-            data = json.loads(conn.recv())
-            logger.debug(data)
-            
-            topic = data['topic']
-            payload = data['payload']
+    # frames are captured and encoded by the camera process
 
-            succes, mid = publish(topic, payload)
-            
+    buffer = camera_buffers[index]
 
-def thread_loop_image():
-    import cv2
+    # setup storage client
 
-    bucket_name = 'danarchy-io'
-    bucket_path = 'iotcore/images'
+    storage = image_storage or GCSImages(image_bucket)
 
-    # setup camera
+    while True:
+        supervisor_heartbeat('thread_image_events_{}'.format(index))
 
-    camera = cv2.VideoCapture(0)
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+        frame = buffer.get(timeout=10)
+        if not frame:
+            continue
 
-    # setup storage client
+        # bandwidth_images 0 stops the uploads, the frames are dropped
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+        if bandwidth.disabled['images']:
+            continue
 
-    image_path = '/tmp/image.jpg'
+        sequence, date, image = frame
+        date = datetime.datetime.fromtimestamp(date / 1000, tz)
 
-    while True:
-        # take a snapshot, and save it
+        # upload it
+        
+        blob_name = '{}/{}.jpg'.format(bucket_path, str(date))
 
-        value, image = camera.read()
-        cv2.imwrite(image_path, image)
+        try:
+            url = storage.upload(blob_name, image)
+        except:
+            logger.exception('while uploading %s', blob_name)
+            continue
 
-        # upload it to gcs
-        
-        blob_name = '{}/{}.jpg'.format(bucket_path, str(datetime.datetime.now(tz)))
-        blob = bucket.blob(blob_name)
-        blob.upload_from_filename(image_path)
+        logger.info('uploaded => %s', url)
 
-        logger.info('uploaded => gs://{}/{}'.format(bucket_name, blob_name))
+        image_last_blob = blob_name
+        image_event_uploaded.set()
 
         try:
-            bucket.copy_blob(
-                blob, 
-                bucket, 
-                '{}/last.jpg'.format(bucket_path)
-            ).blob.make_public()
+            storage.publish(blob_name, '{}/last.jpg'.format(bucket_path))
         except:
             logger.exception('while copying the image as last.jpg')
 
-        time.sleep(60)
-
 # callbacks: gateway
 
 def callback_config_gateway(client, userdata, message):
@@ -441,6 +1326,7 @@ def callback_config_gateway(client, userdata, message):
         message.topic, 
         str(message.qos)
     )
+    configuration_update(message.topic.split('/')[2], payload)
 
 def callback_error_gateway(client, userdata, message):
     payload = str(message.payload.decode('utf-8'))
@@ -459,6 +1345,7 @@ def callback_command_gateway(client, userdata, message):
         message.topic, 
         str(message.qos)
     )
+    command_dispatch(message.topic.split('/')[2], message.topic, payload)
 
 # callbacks: sensor
 
@@ -470,6 +1357,7 @@ def callback_config_sensor(client, userdata, message):
         message.topic, 
         str(message.qos)
     )
+    configuration_update(message.topic.split('/')[2], payload)
 
 def callback_error_sensor(client, userdata, message):
     payload = str(message.payload.decode('utf-8'))
@@ -488,6 +1376,7 @@ def callback_command_sensor(client, userdata, message):
         message.topic, 
         str(message.qos)
     )
+    command_dispatch(message.topic.split('/')[2], message.topic, payload)
 
 # setups
 
@@ -497,6 +1386,8 @@ def setup_connect():
 
     logger.info('starting mqtt client...')
 
+    connection_event_stop.clear()
+
     connection_client = build_client(
         connection_project, 
         connection_region, 
@@ -508,7 +1399,8 @@ def setup_connect():
         callback_disconnect=callback_disconnect,
         callback_publish=callback_publish,
         callback_subscribe=callback_subscribe,
-        callback_message=callback_message
+        callback_message=callback_message,
+        clean_session=not connection_persistent
     )
 
     thread_connection = threading.Thread(
@@ -520,8 +1412,11 @@ def setup_connect():
 def setup_disconnect():
     global connection_client
     global connection_connected
+    global thread_connection
 
     with lock_connection:
+        connection_event_stop.set()
+
         if connection_client and connection_connected:
             logger.info('detaching devices from the gateway...')
             devices = {
@@ -542,7 +1437,20 @@ def setup_disconnect():
             if not connection_event_disconnected.is_set():
                 logger.error('disconnection timeout')
 
-def setup_devices():
+    # the next connection builds a new client, the loop of this one exits
+    # on stop and its socket is closed even if the disconnection timed out
+
+    if thread_connection:
+        thread_connection.join(timeout=connection_timeout)
+        if thread_connection.is_alive():
+            logger.error('thread_connection still running')
+
+    if connection_client:
+        sock = connection_client.socket()
+        if sock:
+            sock.close()
+
+def setup_devices(subscribe=True):
     global connection_devices
     global connection_publish_mid
     global barrier_connection_devices
@@ -563,14 +1471,22 @@ def setup_devices():
         mid = setup_attach(connection_client, device)
     
     time.sleep(5)
-    
+
+    # the client is new on every connection, the callbacks are always set,
+    # with a session present the broker kept the subscriptions
+
+    if not subscribe:
+        logger.info('session present, subscriptions kept by the broker')
+
     for device, subtopics in devices.items():
         for subtopic, configuration in subtopics.items():
             qos = configuration['qos']
             callback = configuration['callback']
-            setup_subscribe(connection_client, device, qos, subtopic, callback)
+            setup_subscribe(
+                connection_client, device, qos, subtopic, callback, subscribe
+            )
 
-def setup_subscribe(client, device, qos, subtopic, callback):
+def setup_subscribe(client, device, qos, subtopic, callback, subscribe=True):
         topic = '/devices/{}/{}'.format(device, subtopic)
 
         client.message_callback_add(topic, callback)
@@ -579,6 +1495,9 @@ def setup_subscribe(client, device, qos, subtopic, callback):
             device, topic, callback
         )
 
+        if not subscribe:
+            return
+
         _, mid = client.subscribe(topic, qos=qos)
         logger.info(
             'device \'%s\' => subscribe to %s QoS set to %s, with mid %s', 
@@ -586,49 +1505,92 @@ def setup_subscribe(client, device, qos, subtopic, callback):
         )
 
 def setup_threads():
-    global thread_gateway_state
-    global thread_sensor_listener
-    global thread_sensor_publish
-    global thread_image_events
+    global thread_supervisor
+
+    # workers outlive reconnections, they're registered and started once
+
+    if thread_supervisor:
+        return
 
     # gateway state
 
-    if not thread_gateway_state:
-        thread_gateway_state = threading.Thread(
-            name='thread_gateway_state',
-            target=thread_gateway_state, 
-            args=('/devices/{}/{}'.format(connection_gateway, 'state'),)
-        )
-        thread_gateway_state.start()
+    supervisor_register(
+        'thread_gateway_state',
+        thread_loop_gateway_state,
+        args=('/devices/{}/{}'.format(connection_gateway, 'state'),),
+        timeout=lambda: configuration.ping_interval * 2 + 60
+    )
 
     # sensor listener
 
-    if not thread_sensor_listener:
-        thread_sensor_listener = threading.Thread(
-            name='thread_loop_sensor_listener',
-            target=thread_loop_sensor_listener, 
-        )
-        thread_sensor_listener.start()
+    supervisor_register(
+        'thread_loop_sensor_listener',
+        thread_loop_sensor_listener
+    )
     
-    # sensor publish
+    # sensor publish, one process per sensor, read_retry may take up to 30
+    # seconds
+
+    for device, backend in sensors.items():
+        supervisor_register(
+            'thread_loop_sensor_publish_{}'.format(device),
+            sensor.thread_loop_sensor_publish,
+            args=(
+                '/devices/{}/{}'.format(device, 'events'),
+                (client_host, client_port),
+                client_passwd.encode(),
+                sensor_interval,
+                sensor_interval_max,
+                backend,
+                clock
+            ),
+            process=True,
+            timeout=lambda: configuration.sensor_interval * 2 + 60
+        )
 
-    if not thread_sensor_publish:
-        thread_sensor_publish = Process(
-            name='thread_loop_sensor_publish',
-            target=thread_loop_sensor_publish, 
-            args=('/devices/{}/{}'.format('sensor', 'events'),)
+    # readings http endpoint
+
+    if stores and store_port:
+        supervisor_register(
+            'thread_store_http',
+            thread_loop_store_http
         )
-        thread_sensor_publish.start()
 
-    # images
+    # cameras, capture in a process, upload in a thread
+
+    for index in cameras:
+        camera_buffers[index] = camera.FrameBuffer(processes, camera_buffer_size)
+        camera_captures[index] = processes.Event()
+
+        supervisor_register(
+            'thread_loop_camera_{}'.format(index),
+            camera.thread_loop_camera,
+            args=(
+                index,
+                camera_buffers[index],
+                camera_width,
+                camera_height,
+                camera_interval,
+                camera_captures[index],
+                camera_backend,
+                clock
+            ),
+            process=True,
+            timeout=60
+        )
 
-    if not thread_image_events:
-        thread_image_events = threading.Thread(
-            name='thread_image_events',
-            target=thread_loop_image,
+        supervisor_register(
+            'thread_image_events_{}'.format(index),
+            thread_loop_image,
+            args=(index,),
+            timeout=lambda: configuration.image_interval * 2 + 600
         )
-        thread_image_events.start()
 
+    thread_supervisor = threading.Thread(
+        name='thread_supervisor',
+        target=thread_loop_supervisor,
+    )
+    thread_supervisor.start()
 
 def setup_attach(client, device, auth=''):
     topic = "/devices/{}/attach".format(device)
@@ -674,45 +1636,119 @@ if __name__ == '__main__':
         default=60
     )
 
+    parser.add_argument(
+        '--bandwidth',
+        help='uplink budget in KB/s, 0 is unlimited',
+        metavar='0',
+        type=int,
+        default=0
+    )
+
+    parser.add_argument(
+        '--gateway-config',
+        help='identity and devices of this gateway, see gateway.json',
+        dest='gateway',
+        metavar='/opt/iotcore/gateway.json',
+        type=lambda x: is_valid_file(parser, x)
+    )
+
+    parser.add_argument(
+        '--cameras',
+        help='comma separated camera indexes, as in /dev/video{index}, '
+            'overrides the gateway config',
+        metavar='0',
+        type=lambda x: [int(index) for index in x.split(',')]
+    )
+
+    parser.add_argument(
+        '--store',
+        help='keep the readings in a local time series file, the first '
+            'sensor\'s, the others\' in file.{device}',
+        metavar='/opt/iotcore/data/readings.ts',
+    )
+
+    parser.add_argument(
+        '--store-port',
+        help='serve the local time series over http on this port',
+        metavar='8080',
+        type=int,
+    )
+
+    parser.add_argument(
+        '--persistent-session',
+        help='ask the broker to keep subscriptions and qos 1 messages',
+        dest='persistent',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--logfile',
+        help='log file, written in batches, defaults to stderr',
+        metavar='/opt/iotcore/iotcore.log',
+    )
+
+    parser.add_argument(
+        '--profile',
+        help='profile resources from the start, SIGUSR2 toggles it',
+        metavar='/opt/iotcore/iotcore.profile',
+    )
+
+    parser.add_argument(
+        '--profile-interval',
+        help='seconds between profile samples',
+        metavar='300',
+        type=float,
+        default=300
+    )
+
+    parser.add_argument(
+        '--logdump',
+        help='where the in-memory logs are dumped on SIGUSR1 or a crash',
+        metavar='/opt/iotcore/iotcore.dump',
+    )
+
     args = parser.parse_args()
 
-    logger.info('args => {}'.format(args))
+    logs_pipeline = logs.Pipeline(path=args.logfile, dump=args.logdump).start()
 
-    connection_devices = OrderedDict({
-        connection_gateway : {
-            'config' : {
-                'qos' : 1,
-                'callback' : callback_config_gateway
-            },
-            'errors' : {
-                'qos' : 0,
-                'callback' : callback_error_gateway
-            },
-            'commands/#' : {
-                'qos' : 0,
-                'callback' : callback_command_gateway
-            },
-        },
-        'sensor' : {
-            'config' : {
-                'qos' : 1,
-                'callback' : callback_config_sensor
-            },
-            'errors' : {
-                'qos' : 0,
-                'callback' : callback_error_sensor
-            },
-            'commands/#' : {
-                'qos' : 0,
-                'callback' : callback_command_sensor
-            },
-        },
-    })
+    logger.info('args => %s', args)
+
+    if args.gateway:
+        load_gateway(args.gateway)
+
+    connection_devices = build_devices()
 
     logger.setLevel(args.loglevel.upper())
 
+    check_requirements()
+
     connection_key = args.key
     connection_expire = args.expire
+    connection_persistent = args.persistent
+
+    if args.cameras is not None:
+        cameras = args.cameras
+
+    if args.store:
+        open_stores(args.store)
+        store_port = args.store_port
+
+    configuration_apply(
+        dataclasses.replace(configuration, bandwidth=args.bandwidth * 1024)
+    )
+
+    # the handler may interrupt a thread holding the profiler lock, it
+    # toggles from its own thread
+
+    profiler.interval = args.profile_interval
+    signal.signal(
+        signal.SIGUSR2,
+        lambda *args: threading.Thread(target=profiler.toggle).start()
+    )
+
+    if args.profile:
+        profiler.path = args.profile
+        profiler.start()
 
     while True:
         setup_connect()
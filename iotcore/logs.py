@@ -0,0 +1,193 @@
+"""
+Non-blocking logging pipeline.
+
+Callers only put the record in a queue, repeated records from the same
+call site are rate limited and sampled before that. A listener thread
+formats the records into an in-memory ring buffer and writes them to the
+target in batches, so the sd card sees a write every few seconds instead
+of one per record. The ring buffer is dumped on demand (SIGUSR1) or on an
+uncaught exception.
+"""
+
+import os
+import sys
+import queue
+import atexit
+import signal
+import logging
+import threading
+import logging.handlers
+
+from collections import deque
+
+log_format = '%(asctime)-15s %(name)s [%(levelname)s] %(threadName)s:%(funcName)s:%(lineno)d : %(message)s'
+
+class RateLimit(logging.Filter):
+    # per call site, the first burst records in a period pass, then one
+    # every sample, the next record to pass reports how many were dropped,
+    # errors always pass
+
+    def __init__(self, burst=10, period=60, sample=100):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.sample = sample
+        self.sites = dict()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.pathname, record.lineno)
+
+        with self.lock:
+            site = self.sites.get(key)
+            if not site or record.created - site[0] > self.period:
+                suppressed = site[2] if site else 0
+                site = self.sites[key] = [record.created, 0, 0]
+            else:
+                suppressed = 0
+
+            site[1] += 1
+            if site[1] > self.burst and (site[1] - self.burst) % self.sample:
+                site[2] += 1
+                return False
+
+            suppressed += site[2]
+            site[2] = 0
+
+        if suppressed:
+            record.msg = '{} [{} similar suppressed]'.format(record.msg, suppressed)
+
+        return True
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # the queue never leaves the process, the record is formatted by the
+    # listener thread instead of the caller
+
+    def prepare(self, record):
+        return record
+
+class RingBuffer(logging.Handler):
+
+    def __init__(self, capacity=10000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            self.records.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def dump(self, path):
+        with self.lock:
+            records = list(self.records)
+        with open(path, 'w') as file:
+            for line in records:
+                file.write(line + os.linesep)
+        return len(records)
+
+class Pipeline:
+
+    def __init__(
+        self,
+        path=None,
+        dump=None,
+        level=logging.INFO,
+        capacity=10000,
+        batch=500,
+        interval=5,
+        burst=10,
+        period=60,
+        sample=100
+    ):
+        self.dump_path = dump
+        self.level = level
+        self.interval = interval
+        self.stopped = threading.Event()
+
+        formatter = logging.Formatter(log_format)
+
+        # ring buffer, always has the latest records
+
+        self.ring = RingBuffer(capacity)
+        self.ring.setFormatter(formatter)
+
+        # target, batched until full, an error, or the flush interval
+
+        if path:
+            target = logging.FileHandler(path)
+        else:
+            target = logging.StreamHandler()
+        target.setFormatter(formatter)
+
+        self.target = logging.handlers.MemoryHandler(
+            batch, flushLevel=logging.ERROR, target=target
+        )
+
+        # queue, the only handler seen by the callers
+
+        self.queue = queue.SimpleQueue()
+        self.handler = QueueHandler(self.queue)
+        self.handler.addFilter(RateLimit(burst, period, sample))
+
+        self.listener = logging.handlers.QueueListener(
+            self.queue, self.ring, self.target
+        )
+
+        self.flusher = threading.Thread(
+            name='thread_logs_flush',
+            target=self.loop_flush,
+            daemon=True
+        )
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+        self.listener.start()
+        self.flusher.start()
+
+        # dump on demand, and on crash
+
+        if self.dump_path:
+            signal.signal(signal.SIGUSR1, lambda *args: self.dump())
+
+            excepthook = sys.excepthook
+            def crash(*args):
+                excepthook(*args)
+                self.dump()
+            sys.excepthook = crash
+
+            if hasattr(threading, 'excepthook'):
+                threadhook = threading.excepthook
+                def crash_thread(args):
+                    threadhook(args)
+                    self.dump()
+                threading.excepthook = crash_thread
+
+        atexit.register(self.stop)
+
+        return self
+
+    def loop_flush(self):
+        while not self.stopped.wait(timeout=self.interval):
+            self.target.flush()
+
+    def dump(self, path=None):
+        path = path or self.dump_path
+        logging.getLogger(__name__).error('dumping logs to %s', path)
+        self.target.flush()
+        return path, self.ring.dump(path)
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.listener.stop()
+        self.target.flush()
@@ -0,0 +1,225 @@
+"""
+Resource profiler, samples the agent while it runs and writes a compact
+json line per sample.
+
+Each sample has the rss, threads, open fds, files in the temp directory,
+the rss of the child processes, and, while tracemalloc runs, the traced
+memory and the lines that allocated the most since the previous sample.
+A metric growing by more than its threshold since the first sample logs
+an alert, and again at every further threshold, so slow growth shows up
+in a soak run.
+
+  profiler = Profiler('/tmp/iotcore.profile', interval=300)
+  profiler.start()
+  profiler.stop()
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# growth since the first sample that raises an alert
+
+thresholds = {
+    'rss' : 16 * 1024 * 1024,
+    'traced' : 8 * 1024 * 1024,
+    'threads' : 8,
+    'fds' : 16,
+    'tempfiles' : 8,
+}
+
+def rss(pid='self'):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+def tempfiles():
+    try:
+        return len(os.listdir(tempfile.gettempdir()))
+    except OSError:
+        return None
+
+class Profiler:
+
+    def __init__(
+        self,
+        path,
+        interval=300,
+        top=10,
+        frames=1,
+        children=None,
+        thresholds=thresholds
+    ):
+        # children returns {name : pid} of the processes to sample
+
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.children = children
+        self.thresholds = thresholds
+
+        # lock guards start and stop, sampling the samples, the profile
+        # command samples while the thread runs
+
+        self.lock = threading.Lock()
+        self.sampling = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.tracing = False
+
+        self.baseline = None
+        self.alerted = dict()
+        self.snapshot = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return False
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.tracing = True
+
+            self.baseline = None
+            self.alerted = dict()
+            self.snapshot = None
+            self.stopped.clear()
+
+            self.thread = threading.Thread(
+                name='thread_profiler',
+                target=self.loop,
+                daemon=True
+            )
+            self.thread.start()
+
+        logger.info('profiling to %s every %ss', self.path, self.interval)
+        return True
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return False
+
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+            # only stop what was started here, the snapshots go with it
+
+            with self.sampling:
+                if self.tracing:
+                    tracemalloc.stop()
+                    self.tracing = False
+                self.snapshot = None
+
+        logger.info('profiling stopped')
+        return True
+
+    def toggle(self):
+        # returns whether the profiler runs afterwards
+
+        if self.running:
+            self.stop()
+            return False
+        return self.start()
+
+    def loop(self):
+        while True:
+            try:
+                self.write(self.sample())
+            except Exception:
+                logger.exception('while profiling')
+            if self.stopped.wait(timeout=self.interval):
+                break
+
+    def sample(self):
+        with self.sampling:
+            sample = {
+                'ts' : round(time.time(), 1),
+                'rss' : rss(),
+                'threads' : threading.active_count(),
+                'fds' : fds(),
+                'tempfiles' : tempfiles(),
+            }
+
+            if self.children:
+                sample['children'] = {
+                    name : rss(pid) for name, pid in self.children().items()
+                }
+
+            # allocations since the previous sample, by line
+
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                ])
+                sample['traced'] = tracemalloc.get_traced_memory()[0]
+
+                if self.snapshot is not None:
+                    stats = [
+                        stat for stat in snapshot.compare_to(self.snapshot, 'lineno')
+                        if stat.size_diff > 0
+                    ]
+                    sample['growth'] = [
+                        '{}:{} {:+d}'.format(
+                            stat.traceback[0].filename, stat.traceback[0].lineno,
+                            stat.size_diff
+                        )
+                        for stat in stats[:self.top]
+                    ]
+                self.snapshot = snapshot
+
+            alerts = self.check(sample)
+            if alerts:
+                sample['alerts'] = alerts
+
+            return sample
+
+    def check(self, sample):
+        # metrics grown by another threshold since the first sample
+
+        if self.baseline is None:
+            self.baseline = sample
+            return []
+
+        alerts = list()
+        for name, threshold in self.thresholds.items():
+            if sample.get(name) is None or self.baseline.get(name) is None:
+                continue
+
+            growth = sample[name] - self.baseline[name]
+            steps = int(growth // threshold)
+            if steps > self.alerted.get(name, 0):
+                self.alerted[name] = steps
+                alerts.append(name)
+                logger.warning(
+                    '%s grew by %s since %s, from %s to %s',
+                    name, growth, self.baseline['ts'],
+                    self.baseline[name], sample[name]
+                )
+
+        return alerts
+
+    def write(self, sample):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(sample, separators=(',', ':')) + os.linesep)
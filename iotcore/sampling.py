@@ -0,0 +1,89 @@
+"""
+Adaptive sampling interval for the sensor loop.
+
+The interval drops as soon as the readings move faster than the
+thresholds, to the floor on a spike, and grows back slowly towards the
+ceiling while they are stable, so quiet nights cost a reading a minute
+instead of twenty.
+
+  sampler = AdaptiveSampler(floor=3, ceiling=60)
+  interval = sampler.update(clock.monotonic(), h, t, flag_h, flag_t)
+"""
+
+class AdaptiveSampler:
+
+    def __init__(
+        self,
+        floor=3.0,
+        ceiling=60.0,
+        humidity=1.0,
+        temperature=0.3,
+        increase=1.25,
+        smoothing=0.5
+    ):
+        # humidity and temperature are the changes, percent and celsius,
+        # worth a reading, above the sensor noise, increase is the factor
+        # the interval grows by while stable, smoothing weights the latest
+        # rate of change
+
+        self.floor = floor
+        self.ceiling = ceiling
+        self.thresholds = (humidity, temperature)
+        self.increase = increase
+        self.smoothing = smoothing
+
+        self.interval = floor
+        self.last = None
+        self.rates = (0.0, 0.0)
+
+    def configure(self, floor, ceiling):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        return self.clamp()
+
+    def clamp(self):
+        self.interval = min(max(self.interval, self.floor), self.ceiling)
+        return self.interval
+
+    def update(self, now, h, t, flag_h=0, flag_t=0):
+        # now is monotonic seconds, returns the seconds to the next reading
+
+        if flag_h == 2 or flag_t == 2:
+            self.last = (now, h, t)
+            self.interval = self.floor
+            return self.interval
+
+        # a missing reading repeats the last value, it says nothing about
+        # the rate of change
+
+        if flag_h == 1 or flag_t == 1 or self.last is None:
+            if self.last is None:
+                self.last = (now, h, t)
+            return self.clamp()
+
+        since, last_h, last_t = self.last
+        self.last = (now, h, t)
+
+        elapsed = now - since
+        if elapsed <= 0:
+            return self.clamp()
+
+        self.rates = tuple(
+            self.smoothing * abs(value - last) / elapsed + (1 - self.smoothing) * rate
+            for value, last, rate in zip((h, t), (last_h, last_t), self.rates)
+        )
+
+        # the longest interval over which neither value changes by more than
+        # its threshold
+
+        limit = min(
+            threshold / rate if rate else self.ceiling
+            for threshold, rate in zip(self.thresholds, self.rates)
+        )
+
+        if limit < self.interval:
+            self.interval = limit
+        else:
+            self.interval = min(self.interval * self.increase, limit)
+
+        return self.clamp()
@@ -0,0 +1,106 @@
+"""
+DHT22 sensor loop, runs in its own process started from a forkserver, so
+it only imports what it needs, no mqtt, gcs or jwt.
+"""
+
+import time
+import logging
+
+from multiprocessing.connection import Client
+
+import telemetry
+
+from sampling import AdaptiveSampler
+
+logger = logging.getLogger(__name__)
+
+# sensor
+
+class DHT22:
+
+    def __init__(self, pin=4):
+        self.pin = pin
+
+    def read(self):
+        # (humidity, temperature), either one can be None
+
+        import Adafruit_DHT as adafruit
+
+        return adafruit.read_retry(adafruit.DHT22, self.pin)
+
+def thread_loop_sensor_publish(
+    topic, address, authkey, interval, interval_max, sensor, clock, heartbeat
+):
+    # interval and interval_max are the floor and ceiling of the sampling
+    # interval, shared with the agent
+
+    conn = Client(address, authkey=authkey)
+    sampler = AdaptiveSampler(interval.value, interval_max.value)
+
+    last_h = 0
+    last_t = 0
+
+    first_run = True
+
+    while True:
+        heartbeat.value = time.monotonic()
+
+        try:
+            h,t = sensor.read()
+
+            flag_h = 0
+            flag_t = 0
+
+            if h is None:
+                flag_h = 1
+                h = last_h
+
+            if t is None:
+                flag_t = 1
+                t = last_t
+
+            if not first_run and abs(h - last_h) >= 5:
+                flag_h = 2
+
+            if not first_run and abs(t - last_t) >= 5:
+                flag_t = 2
+
+            last_h = h
+            last_t = t
+            first_run = False
+
+            payload = telemetry.encode(
+                int(clock.time() * 1000),
+                h,
+                t,
+                flag_h,
+                flag_t
+            )
+
+            data = {
+                'topic' : topic,
+                'payload' : payload,
+            }
+
+            conn.send(data)
+
+            sampler.configure(interval.value, interval_max.value)
+            sampler.update(clock.monotonic(), h, t, flag_h, flag_t)
+
+        except Exception as e:
+            logger.exception('there was an error, check the stacktrace...')
+
+        # sleep in steps, so a new floor or ceiling applies right away
+
+        since = clock.monotonic()
+        while True:
+            heartbeat.value = time.monotonic()
+            remaining = sampler.configure(
+                interval.value, interval_max.value
+            ) - (clock.monotonic() - since)
+            if remaining <= 0:
+                break
+            clock.sleep(min(remaining, 1))
+
+    conn.send('close connection')
+    conn.close()
@@ -0,0 +1,339 @@
+"""
+Simulated hardware and a soak harness, runs the agent loops off-device.
+
+The DHT22 and the camera are replaced by simulated backends, mqtt and gcs
+by in-memory sinks, and the clock by an accelerated clock, so a week of
+operation runs in about a minute at the default speed.
+
+  python simulation.py --days 7 --speed 10000
+  python simulation.py --days 1 --outage-every 6 --outage-for 30 --dropout 0.1
+
+Prints a json line per report interval with throughput, queue length and
+memory, and a summary at the end.
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import math
+import time
+import random
+import struct
+import argparse
+import functools
+import threading
+import dataclasses
+import tracemalloc
+
+from collections import Counter
+from collections import OrderedDict
+
+from clock import AcceleratedClock
+from profiler import rss
+
+# hardware
+
+class SimulatedDHT22:
+    # daily temperature and humidity cycles plus noise, dropouts return
+    # None as the real sensor does, spikes jump several degrees
+
+    def __init__(
+        self,
+        clock,
+        noise=0.2,
+        dropout=0.02,
+        spike=0.002,
+        latency=0.5,
+        seed=None
+    ):
+        self.clock = clock
+        self.noise = noise
+        self.dropout = dropout
+        self.spike = spike
+        self.latency = latency
+        self.random = random.Random(seed)
+
+    def read(self):
+        self.clock.sleep(self.latency)
+
+        phase = 2 * math.pi * (self.clock.time() % 86400) / 86400 - math.pi / 2
+
+        temperature = 20 + 6 * math.sin(phase) + self.random.gauss(0, self.noise)
+        humidity = 60 - 15 * math.sin(phase) + self.random.gauss(0, self.noise * 2)
+
+        if self.random.random() < self.spike:
+            temperature += self.random.choice([-1, 1]) * self.random.uniform(5, 15)
+
+        h = min(max(humidity, 0), 100)
+        t = temperature
+
+        if self.random.random() < self.dropout:
+            h = None
+        if self.random.random() < self.dropout:
+            t = None
+
+        return h, t
+
+class SimulatedCamera:
+    # synthetic jpeg sized frames, ratio bytes per pixel
+
+    def __init__(self, index, ratio=0.1, failure=0.0, seed=None):
+        self.index = index
+        self.ratio = ratio
+        self.failure = failure
+        self.random = random.Random(seed)
+        self.size = (1280, 720)
+        self.frame = 0
+
+    def resolution(self, width, height):
+        self.size = (width, height)
+
+    def capture(self):
+        if self.random.random() < self.failure:
+            raise RuntimeError('simulated capture failure')
+
+        self.frame += 1
+        length = int(self.size[0] * self.size[1] * self.ratio)
+        body = struct.pack('>II', self.index, self.frame) * (length // 8 + 1)
+
+        return b'\xff\xd8' + body[:length] + b'\xff\xd9'
+
+# sinks
+
+class SimulatedClient:
+    # stands for the paho client, publish returns (rc, mid)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mid = 0
+        self.messages = Counter()
+        self.bytes = Counter()
+
+    def publish(self, topic, payload, qos=0):
+        kind = topic.rsplit('/', 1)[-1]
+        with self.lock:
+            self.mid += 1
+            self.messages[kind] += 1
+            self.bytes[kind] += len(topic) + len(payload)
+            return 0, self.mid
+
+class SimulatedStorage:
+    # stands for GCSImages, reads the body through the bandwidth scheduler
+
+    def __init__(self, bandwidth, failure=0.0, seed=None):
+        self.bandwidth = bandwidth
+        self.failure = failure
+        self.random = random.Random(seed)
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+
+    def upload(self, name, data):
+        if self.random.random() < self.failure:
+            self.failures += 1
+            raise RuntimeError('simulated upload failure')
+
+        reader = self.bandwidth.reader('images', data)
+        while reader.read(8192):
+            pass
+
+        self.uploads += 1
+        self.bytes += len(data)
+
+        return 'sim://{}'.format(name)
+
+    def publish(self, name, public_name):
+        pass
+
+# measurements
+
+def megabytes(value):
+    return None if value is None else round(value / 1024 / 1024, 2)
+
+def report(agent, client, storage, clock, started):
+    processes = {
+        name : megabytes(rss(worker['worker'].pid))
+        for name, worker in agent.supervisor_workers.items()
+        if worker['process'] and worker['worker'] and worker['worker'].is_alive()
+    }
+
+    # a restart is recorded each time a worker dies, not when it first starts
+
+    restarts = {
+        name : len(worker['restarts'])
+        for name, worker in agent.supervisor_workers.items()
+        if len(worker['restarts']) > 0
+    }
+
+    real = time.monotonic() - started
+
+    return {
+        'days' : round((clock.time() - clock.origin) / 86400, 3),
+        'real' : round(real, 1),
+        'messages' : dict(client.messages),
+        'messages_per_second' : round(sum(client.messages.values()) / real, 1),
+        'uploads' : storage.uploads,
+        'upload_failures' : storage.failures,
+        'upload_mb' : megabytes(storage.bytes),
+        'queue' : len(agent.publish_queue),
+        'stored' : {
+            device : len(store) for device, store in agent.stores.items()
+        } or None,
+        'rss_mb' : megabytes(rss()),
+        'processes_rss_mb' : processes,
+        'tracemalloc_mb' : megabytes(tracemalloc.get_traced_memory()[0])
+            if tracemalloc.is_tracing() else None,
+        'threads' : threading.active_count(),
+        'restarts' : restarts,
+    }
+
+def thread_loop_outages(agent, clock, every, duration):
+    # drops the connection every hours for minutes of simulated time
+
+    while True:
+        clock.sleep(every * 3600)
+        with agent.lock_connection:
+            agent.connection_connected = False
+        clock.sleep(duration * 60)
+        with agent.lock_connection:
+            agent.connection_connected = True
+        agent.flush_offline()
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--speed', type=float, default=10000)
+    parser.add_argument('--report', help='hours', type=float, default=24)
+    parser.add_argument('--sensors', type=int, default=1)
+    parser.add_argument('--cameras', type=int, default=1)
+    parser.add_argument('--port', type=int, default=7778)
+    parser.add_argument('--seed', type=int)
+
+    parser.add_argument('--noise', type=float, default=0.2)
+    parser.add_argument('--dropout', type=float, default=0.02)
+    parser.add_argument('--spike', type=float, default=0.002)
+    parser.add_argument('--camera-failure', type=float, default=0.0)
+    parser.add_argument('--upload-failure', type=float, default=0.0)
+
+    parser.add_argument('--outage-every', help='hours', type=float)
+    parser.add_argument('--outage-for', help='minutes', type=float, default=10)
+
+    parser.add_argument(
+        '--bandwidth',
+        help='uplink budget in simulated KB/s, 0 is unlimited',
+        type=int,
+        default=0
+    )
+
+    parser.add_argument('--store', help='time series file, file.{device} after the first sensor')
+    parser.add_argument('--tracemalloc', action='store_true')
+    parser.add_argument('--profile', help='agent profile, see profiler.py')
+    parser.add_argument(
+        '--profile-interval',
+        help='real seconds',
+        type=float,
+        default=5
+    )
+    parser.add_argument('--loglevel', default='ERROR')
+
+    args = parser.parse_args()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    import iotcore as agent
+
+    agent.logging.getLogger().setLevel(args.loglevel.upper())
+    agent.logger.setLevel(args.loglevel.upper())
+
+    clock = AcceleratedClock(args.speed)
+
+    # the agent, wired to the simulated hardware and sinks, the bandwidth
+    # scheduler runs in real time so the budget is scaled by the speed
+
+    client = SimulatedClient()
+    storage = SimulatedStorage(agent.bandwidth, args.upload_failure, args.seed)
+
+    agent.clock = clock
+    agent.client_port = args.port
+    agent.connection_client = client
+    agent.connection_connected = True
+    agent.cameras = list(range(args.cameras))
+    agent.image_storage = storage
+    agent.sensors = OrderedDict(
+        (
+            'sensor-{}'.format(index) if index else 'sensor',
+            SimulatedDHT22(
+                clock, args.noise, args.dropout, args.spike, seed=args.seed
+            )
+        )
+        for index in range(args.sensors)
+    )
+    agent.camera_backend = functools.partial(
+        SimulatedCamera, failure=args.camera_failure, seed=args.seed
+    )
+
+    if args.store:
+        agent.open_stores(args.store)
+
+    agent.configuration_apply(dataclasses.replace(
+        agent.configuration, bandwidth=int(args.bandwidth * 1024 * args.speed)
+    ))
+
+    started = time.monotonic()
+
+    agent.setup_threads()
+
+    if args.profile:
+        agent.profiler.path = args.profile
+        agent.profiler.interval = args.profile_interval
+        agent.profiler.start()
+
+    if args.outage_every:
+        threading.Thread(
+            name='thread_outages',
+            target=thread_loop_outages,
+            args=(agent, clock, args.outage_every, args.outage_for),
+            daemon=True
+        ).start()
+
+    # report until the simulated days are over
+
+    reports = list()
+    end = clock.origin + args.days * 86400
+    while clock.time() < end:
+        clock.sleep(min(args.report * 3600, end - clock.time()))
+        reports.append(report(agent, client, storage, clock, started))
+        print(json.dumps(reports[-1]), flush=True)
+
+    summary = {
+        'days' : args.days,
+        'speed' : args.speed,
+        'real' : reports[-1]['real'],
+        'messages' : sum(reports[-1]['messages'].values()),
+        'messages_per_simulated_day' : round(
+            sum(reports[-1]['messages'].values()) / args.days
+        ),
+        'uploads' : reports[-1]['uploads'],
+        'queue_max' : max(r['queue'] for r in reports),
+        'rss_growth_mb' : round(
+            (reports[-1]['rss_mb'] or 0) - (reports[0]['rss_mb'] or 0), 2
+        ),
+        'restarts' : reports[-1]['restarts'],
+    }
+    print(json.dumps({'summary' : summary}), flush=True)
+
+    # the agent threads never exit, terminate the processes and leave
+
+    for worker in agent.supervisor_workers.values():
+        if worker['process'] and worker['worker']:
+            worker['worker'].terminate()
+
+    os._exit(0)
@@ -0,0 +1,136 @@
+"""
+Telemetry encoding, shared by the agent and the pubsub reader.
+
+Binary, version 1, 16 bytes, big endian:
+
+  magic     2s  b'RT'
+  version   B   1
+  date      q   epoch milliseconds
+  humidity  h   percent * 100
+  temp      h   celsius * 100
+  flags     B   flag_humidity bits 0-1, flag_temperature bits 2-3
+
+Legacy CSV, ~50 bytes:
+
+  2021-05-31 00:56:23.974782+00:00,55.10,21.30,0,0
+
+Flags: 0 ok, 1 missing reading (last value repeated), 2 spike.
+"""
+
+import struct
+import datetime
+
+from collections import namedtuple
+
+# readings
+
+Reading = namedtuple(
+    'Reading',
+    ['date', 'humidity', 'temperature', 'flag_humidity', 'flag_temperature']
+)
+
+# schema
+
+MAGIC = b'RT'
+VERSION = 1
+
+header = struct.Struct('>2sB')
+
+schemas = {
+    1 : struct.Struct('>2sBqhhB'),
+}
+
+scale = 100
+
+# encode
+
+def encode(date, humidity, temperature, flag_humidity=0, flag_temperature=0):
+    # date is epoch milliseconds
+
+    return schemas[VERSION].pack(
+        MAGIC,
+        VERSION,
+        int(date),
+        int(round(humidity * scale)),
+        int(round(temperature * scale)),
+        (flag_humidity & 0b11) | (flag_temperature & 0b11) << 2
+    )
+
+def encode_csv(date, humidity, temperature, flag_humidity=0, flag_temperature=0):
+    date = datetime.datetime.fromtimestamp(date / 1000, datetime.timezone.utc)
+    return '{},{:.2f},{:.2f},{},{}'.format(
+        str(date), humidity, temperature, flag_humidity, flag_temperature
+    ).encode('utf-8')
+
+# decode
+
+def decode(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    if data[:2] != MAGIC:
+        return decode_csv(data)
+    if len(data) < header.size:
+        raise ValueError('telemetry header is {} bytes, got {}'.format(header.size, len(data)))
+
+    _, version = header.unpack_from(data)
+    schema = schemas.get(version)
+    if not schema:
+        raise ValueError('unknown telemetry version {}'.format(version))
+    if len(data) != schema.size:
+        raise ValueError('telemetry version {} is {} bytes, got {}'.format(
+            version, schema.size, len(data)
+        ))
+
+    _, _, date, humidity, temperature, flags = schema.unpack(data)
+
+    return Reading(
+        date,
+        humidity / scale,
+        temperature / scale,
+        flags & 0b11,
+        flags >> 2 & 0b11
+    )
+
+def decode_many(payloads):
+    # readings of a batch, None where a payload doesn't decode, payloads of
+    # the current version are unpacked in a single pass
+
+    schema = schemas[VERSION]
+    prefix = header.pack(MAGIC, VERSION)
+
+    readings = [None] * len(payloads)
+
+    fast = [
+        index for index, data in enumerate(payloads)
+        if len(data) == schema.size and data[:len(prefix)] == prefix
+    ]
+    values = schema.iter_unpack(b''.join(payloads[index] for index in fast))
+    for index, (_, _, date, humidity, temperature, flags) in zip(fast, values):
+        readings[index] = Reading(
+            date,
+            humidity / scale,
+            temperature / scale,
+            flags & 0b11,
+            flags >> 2 & 0b11
+        )
+
+    for index, data in enumerate(payloads):
+        if readings[index] is None:
+            try:
+                readings[index] = decode(data)
+            except (ValueError, UnicodeDecodeError):
+                pass
+
+    return readings
+
+def decode_csv(data):
+    date, h, t, flag_h, flag_t = data.decode('utf-8').split(',')
+    date = datetime.datetime.fromisoformat(date)
+    return Reading(
+        int(round(date.timestamp() * 1000)),
+        float(h),
+        float(t),
+        int(flag_h),
+        int(flag_t)
+    )
@@ -0,0 +1,337 @@
+"""
+On-device time series, a memory-mapped ring file of fixed size records.
+
+Records are appended in time order, so the ring is its own time index,
+queries bisect on the date of the records.
+
+Header, 64 bytes, little endian:
+
+  magic     4s  b'RTTS'
+  version   B   1
+  size      H   record size
+  capacity  Q   records
+  head      Q   next record to write
+  count     Q   records written, up to capacity
+
+Record, 16 bytes:
+
+  date      q   epoch milliseconds
+  humidity  h   percent * 100
+  temp      h   celsius * 100
+  flags     B   as in telemetry.py
+
+  python timeseries.py readings.ts latest
+  python timeseries.py readings.ts range --start 1622422583000
+  python timeseries.py readings.ts aggregate --bucket 3600000
+  python timeseries.py readings.ts serve --port 8080
+"""
+
+#!/usr/bin/env python
+
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import mmap
+import struct
+import argparse
+import threading
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+
+from telemetry import Reading
+from telemetry import scale
+
+# layout
+
+MAGIC = b'RTTS'
+VERSION = 1
+
+header = struct.Struct('<4sBxHQQQ')
+header_size = 64
+
+record = struct.Struct('<qhhB3x')
+
+# four weeks, sampling every 3 seconds, ~13MB
+
+capacity = 28 * 24 * 60 * 60 // 3
+
+class TimeSeries:
+
+    def __init__(self, path, capacity=capacity):
+        self.path = path
+        self.lock = threading.RLock()
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as file:
+                file.write(
+                    header.pack(MAGIC, VERSION, record.size, capacity, 0, 0)
+                )
+                file.truncate(header_size + capacity * record.size)
+
+        self.file = open(path, 'r+b')
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+
+        magic, version, size, self.capacity, _, _ = header.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION or size != record.size:
+            self.close()
+            raise ValueError('{} is not a version {} time series'.format(
+                path, VERSION
+            ))
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.state()[1]
+
+    # header
+
+    def state(self):
+        _, _, _, _, head, count = header.unpack_from(self.mmap)
+        return head, count
+
+    def offset(self, index, head, count):
+        # logical index, 0 is the oldest record
+
+        return header_size + (head - count + index) % self.capacity * record.size
+
+    # write
+
+    def append(self, date, humidity, temperature, flag_humidity=0, flag_temperature=0):
+        with self.lock:
+            head, count = self.state()
+
+            if count and date < self.date(count - 1, head, count):
+                raise ValueError('{} is older than the latest record'.format(date))
+
+            record.pack_into(
+                self.mmap,
+                header_size + head * record.size,
+                int(date),
+                int(round(humidity * scale)),
+                int(round(temperature * scale)),
+                (flag_humidity & 0b11) | (flag_temperature & 0b11) << 2
+            )
+
+            # the header is updated last, readers never see a partial record
+
+            header.pack_into(
+                self.mmap, 0, MAGIC, VERSION, record.size, self.capacity,
+                (head + 1) % self.capacity, min(count + 1, self.capacity)
+            )
+
+    def flush(self):
+        self.mmap.flush()
+
+    # read
+
+    def date(self, index, head, count):
+        return struct.unpack_from('<q', self.mmap, self.offset(index, head, count))[0]
+
+    def bisect(self, date, head, count):
+        # first logical index with a date >= date
+
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self.date(middle, head, count) < date:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, start, end, head, count):
+        # logical [start, end) as at most two contiguous slices of the ring
+
+        while start < end:
+            first = (head - count + start) % self.capacity
+            length = min(end - start, self.capacity - first)
+            offset = header_size + first * record.size
+            yield from record.iter_unpack(
+                self.mmap[offset:offset + length * record.size]
+            )
+            start += length
+
+    def range(self, start=None, end=None):
+        # readings with start <= date < end, dates in epoch milliseconds
+
+        with self.lock:
+            head, count = self.state()
+            first = 0 if start is None else self.bisect(start, head, count)
+            last = count if end is None else self.bisect(end, head, count)
+            return [
+                reading(*values)
+                for values in self.records(first, last, head, count)
+            ]
+
+    def latest(self, n=1):
+        if n < 0:
+            raise ValueError('n must be >= 0, got {}'.format(n))
+
+        with self.lock:
+            head, count = self.state()
+            return [
+                reading(*values)
+                for values in self.records(max(count - n, 0), count, head, count)
+            ]
+
+    def aggregate(self, start=None, end=None, bucket=60 * 60 * 1000):
+        if bucket <= 0:
+            raise ValueError('bucket must be > 0, got {}'.format(bucket))
+
+        buckets = list()
+
+        with self.lock:
+            head, count = self.state()
+            first = 0 if start is None else self.bisect(start, head, count)
+            last = count if end is None else self.bisect(end, head, count)
+
+            current = None
+            for date, h, t, flags in self.records(first, last, head, count):
+                key = date - date % bucket
+                if not current or current['date'] != key:
+                    current = {
+                        'date' : key,
+                        'count' : 0,
+                        'flagged' : 0,
+                        'humidity' : [h, 0, h],
+                        'temperature' : [t, 0, t],
+                    }
+                    buckets.append(current)
+
+                current['count'] += 1
+                current['flagged'] += 1 if flags else 0
+                for name, value in (('humidity', h), ('temperature', t)):
+                    values = current[name]
+                    values[0] = min(values[0], value)
+                    values[1] += value
+                    values[2] = max(values[2], value)
+
+        for current in buckets:
+            for name in ('humidity', 'temperature'):
+                low, total, high = current.pop(name)
+                current[name + '_min'] = low / scale
+                current[name + '_avg'] = round(total / current['count'] / scale, 2)
+                current[name + '_max'] = high / scale
+
+        return buckets
+
+def reading(date, humidity, temperature, flags):
+    return Reading(
+        date, humidity / scale, temperature / scale, flags & 0b11, flags >> 2 & 0b11
+    )
+
+# http
+
+def build_server(store, host='localhost', port=8080, stores=None):
+    # GET /latest?n=10
+    # GET /range?start=1622422583000&end=1622426183000
+    # GET /aggregate?start=1622422583000&bucket=3600000
+    # GET /{device}/latest?n=10, stores by device, the same queries
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = url.path
+
+            selected = store
+            if stores and path.count('/') == 2:
+                _, device, path = path.split('/')
+                selected = stores.get(device)
+                path = '/' + path
+                if selected is None:
+                    self.send_error(404)
+                    return
+
+            try:
+                query = {k:int(v[-1]) for k,v in parse_qs(url.query).items()}
+
+                if path == '/latest':
+                    result = selected.latest(query.get('n', 1))
+                elif path == '/range':
+                    result = selected.range(query.get('start'), query.get('end'))
+                elif path == '/aggregate':
+                    result = selected.aggregate(
+                        query.get('start'), query.get('end'),
+                        query.get('bucket', 60 * 60 * 1000)
+                    )
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+
+            body = json.dumps([
+                r._asdict() if isinstance(r, Reading) else r for r in result
+            ]).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+# main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('path', help='time series file')
+
+    parser.add_argument(
+        'command',
+        choices=['latest', 'range', 'aggregate', 'serve']
+    )
+
+    parser.add_argument('--n', type=int, default=1)
+    parser.add_argument('--start', help='epoch milliseconds', type=int)
+    parser.add_argument('--end', help='epoch milliseconds', type=int)
+    parser.add_argument(
+        '--bucket',
+        help='milliseconds',
+        type=int,
+        default=60 * 60 * 1000
+    )
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error('{} not found'.format(args.path))
+
+    with TimeSeries(args.path) as store:
+        if args.command == 'serve':
+            build_server(store, args.host, args.port).serve_forever()
+
+        try:
+            if args.command == 'latest':
+                result = store.latest(args.n)
+            elif args.command == 'range':
+                result = store.range(args.start, args.end)
+            else:
+                result = store.aggregate(args.start, args.end, args.bucket)
+        except ValueError as e:
+            parser.error(str(e))
+
+        for row in result:
+            print(json.dumps(row._asdict() if isinstance(row, Reading) else row))
@@ -0,0 +1,91 @@
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'clients', 'images')
+)
+
+import archive
+
+prefix = 'iotcore/images'
+day = datetime.date(2021, 5, 31)
+midnight = 1622419200000
+
+def upload(store, date, data, path=prefix):
+    # as thread_loop_image names them
+    name = '{}/{}.jpg'.format(
+        path, str(datetime.datetime.fromtimestamp(date / 1000, archive.tz))
+    )
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        file.write(data)
+    store.put(name, file.name)
+    os.remove(file.name)
+    return name
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = archive.LocalStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compact_and_nearest(self):
+        minute = 60 * 1000
+        for index in range(10):
+            upload(self.store, midnight + index * minute, b'frame %d' % index)
+        upload(self.store, midnight + 5 * minute, b'camera 1', prefix + '/1')
+        upload(self.store, midnight - minute, b'day before')
+
+        frames = archive.compact(self.store, prefix, day, delete=True)
+        self.assertEqual(len(frames), 10)
+        self.assertIsNone(archive.compact(self.store, prefix, day))
+
+        # the frames of the day are gone, the other camera and day are not
+        self.assertEqual(
+            [name for name in self.store.list(prefix) if '/archive/' not in name],
+            sorted([
+                '{}/1/2021-05-31 00:05:00+00:00.jpg'.format(prefix),
+                '{}/2021-05-30 23:59:00+00:00.jpg'.format(prefix),
+            ])
+        )
+
+        reader = archive.Archive(self.store, prefix)
+        self.assertEqual(
+            reader.nearest(midnight + 3 * minute + 20 * 1000),
+            (midnight + 3 * minute, b'frame 3')
+        )
+        self.assertEqual(
+            reader.nearest(midnight + 3 * minute + 40 * 1000),
+            (midnight + 4 * minute, b'frame 4')
+        )
+        self.assertEqual(
+            reader.nearest(midnight + 60 * minute),
+            (midnight + 9 * minute, b'frame 9')
+        )
+        self.assertIsNone(reader.nearest(midnight + 10 * 24 * 60 * minute))
+
+    def test_nearest_across_midnight(self):
+        minute = 60 * 1000
+        upload(self.store, midnight - minute, b'before')
+        upload(self.store, midnight + 30 * minute, b'after')
+
+        archive.compact(self.store, prefix, day - datetime.timedelta(days=1))
+        archive.compact(self.store, prefix, day)
+
+        reader = archive.Archive(self.store, prefix)
+        self.assertEqual(reader.nearest(midnight + minute), (midnight - minute, b'before'))
+        self.assertEqual(reader.nearest(midnight - 2 * minute), (midnight - minute, b'before'))
+        self.assertEqual(reader.nearest(midnight + 20 * minute), (midnight + 30 * minute, b'after'))
+
+    def test_closed(self):
+        end = (midnight + 24 * 60 * 60 * 1000) / 1000
+        self.assertFalse(archive.closed(day, end))
+        self.assertTrue(archive.closed(day, end + archive.grace))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+import sys
+import time
+import pathlib
+import unittest
+import threading
+
+sys.path.insert(
+    0, pathlib.Path(__file__).resolve().parent.parent.joinpath('iotcore').as_posix()
+)
+
+from bandwidth import Bandwidth
+
+class TestBandwidth(unittest.TestCase):
+
+    def test_unlimited(self):
+        bandwidth = Bandwidth()
+        start = time.monotonic()
+        for _ in range(100):
+            self.assertTrue(bandwidth.acquire('images', 1024 * 1024))
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_rate(self):
+        bandwidth = Bandwidth(total=10000)
+        bandwidth.acquire('images', 10000)
+        start = time.monotonic()
+        bandwidth.acquire('images', 5000)
+        self.assertGreater(time.monotonic() - start, 0.4)
+
+    def test_priority(self):
+        bandwidth = Bandwidth(total=10000)
+        bandwidth.acquire('images', 10000)
+
+        order = list()
+
+        def acquire(name, nbytes):
+            bandwidth.acquire(name, nbytes)
+            order.append(name)
+
+        telemetry = threading.Thread(target=acquire, args=('telemetry', 1000))
+        telemetry.start()
+        time.sleep(0.01)
+        images = threading.Thread(target=acquire, args=('images', 500))
+        images.start()
+
+        telemetry.join()
+        images.join()
+
+        self.assertEqual(order, ['telemetry', 'images'])
+
+    def test_pause(self):
+        bandwidth = Bandwidth(total=10000)
+        bandwidth.pause('images')
+        self.assertFalse(bandwidth.acquire('images', 10, timeout=0.1))
+        self.assertTrue(bandwidth.acquire('telemetry', 10, timeout=0.1))
+        bandwidth.resume('images')
+        self.assertTrue(bandwidth.acquire('images', 10, timeout=0.1))
+
+    def test_zero_share(self):
+        # a share of 0 disables the class instead of lifting its cap
+        bandwidth = Bandwidth(total=10000, shares={'images' : 0})
+        self.assertTrue(bandwidth.disabled['images'])
+        self.assertFalse(bandwidth.acquire('images', 10, timeout=0.1))
+        self.assertTrue(bandwidth.acquire('telemetry', 10, timeout=0.1))
+
+        bandwidth.configure(10000)
+        self.assertFalse(bandwidth.disabled['images'])
+        self.assertTrue(bandwidth.acquire('images', 10, timeout=0.1))
+
+    def test_small_total(self):
+        bandwidth = Bandwidth(total=5)
+        self.assertEqual(bandwidth.buckets['telemetry'].rate, 1)
+        self.assertEqual(bandwidth.buckets['state'].rate, 1)
+
+    def test_reader_disabled(self):
+        # an upload in flight aborts once its class is disabled
+        bandwidth = Bandwidth(total=10000)
+        reader = bandwidth.reader('images', bytes(30000), 1000)
+        reader.read(1000)
+
+        bandwidth.configure(10000, {'images' : 0})
+        with self.assertRaises(IOError):
+            reader.read(8192)
+
+    def test_reader(self):
+        bandwidth = Bandwidth()
+        reader = bandwidth.reader('images', bytes(range(256)) * 100, 1000)
+        self.assertEqual(len(reader), 25600)
+        data = b''
+        while True:
+            chunk = reader.read(8192)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(data, bytes(range(256)) * 100)
+        self.assertEqual(bandwidth.sent['images'], 25600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'iotcore'))
+
+from camera import FrameBuffer
+
+class TestFrameBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = FrameBuffer(multiprocessing.get_context(), 16)
+
+    def test_put_get(self):
+        self.buffer.put(b'first', 1000)
+        self.assertEqual(self.buffer.get(timeout=1), (1, 1000, b'first'))
+
+        # the second frame goes in the other slot, the third back in the first
+        self.buffer.put(b'second frame', 2000)
+        self.assertEqual(self.buffer.meta[0], 1)
+        self.assertEqual(self.buffer.get(timeout=1), (2, 2000, b'second frame'))
+
+        self.buffer.put(b'third', 3000)
+        self.assertEqual(self.buffer.meta[0], 0)
+        self.assertEqual(self.buffer.get(timeout=1), (3, 3000, b'third'))
+
+    def test_latest(self):
+        # frames not read are skipped, get returns the latest
+        self.buffer.put(b'first', 1000)
+        self.buffer.put(b'second', 2000)
+        self.assertEqual(self.buffer.get(timeout=1), (2, 2000, b'second'))
+
+    def test_oversized(self):
+        with self.assertRaises(ValueError):
+            self.buffer.put(b'x' * 17, 1000)
+        self.assertIsNone(self.buffer.get(timeout=0.01))
+
+    def test_timeout(self):
+        since = time.monotonic()
+        self.assertIsNone(self.buffer.get(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - since, 0.04)
+
+        # a frame is read once
+        self.buffer.put(b'first', 1000)
+        self.assertIsNotNone(self.buffer.get(timeout=1))
+        self.assertIsNone(self.buffer.get(timeout=0.01))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,346 @@
+import os
+import sys
+import time
+import types
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'iotcore'))
+
+import iotcore
+
+class TestConfiguration(unittest.TestCase):
+
+    def test_defaults(self):
+        # fields missing from the document are the defaults, whatever runs
+        first = iotcore.Configuration.parse('{"version": 2, "image_width": 640}')
+        self.assertEqual(first.image_width, 640)
+        self.assertEqual(first.image_height, 720)
+
+        second = iotcore.Configuration.parse('{"version": 3, "image_height": 480}')
+        self.assertEqual(second.image_width, iotcore.Configuration().image_width)
+        self.assertEqual(second.image_height, 480)
+
+    def test_version(self):
+        with self.assertRaisesRegex(ValueError, 'version'):
+            iotcore.Configuration.parse('{"image_width": 640}')
+        with self.assertRaisesRegex(ValueError, 'version'):
+            iotcore.Configuration.parse('{"version": -1}')
+        with self.assertRaisesRegex(ValueError, 'version'):
+            iotcore.Configuration.parse('{"version": 1.5}')
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(ValueError, 'unknown fields'):
+            iotcore.Configuration.parse('{"version": 1, "image_depth": 8}')
+        with self.assertRaises(ValueError):
+            iotcore.Configuration.parse('[1, 2]')
+        with self.assertRaises(ValueError):
+            iotcore.Configuration.parse('{')
+
+    def test_types(self):
+        parsed = iotcore.Configuration.parse(
+            '{"version": 1, "sensor_interval": 5, "image_width": 640.0}'
+        )
+        self.assertIsInstance(parsed.sensor_interval, float)
+        self.assertIsInstance(parsed.image_width, int)
+
+        for document in (
+            '{"version": 1, "image_width": true}',
+            '{"version": 1, "image_width": "640"}',
+            '{"version": 1, "image_width": 640.5}',
+        ):
+            with self.assertRaises(ValueError):
+                iotcore.Configuration.parse(document)
+
+    def test_limits(self):
+        with self.assertRaisesRegex(ValueError, '>= 1'):
+            iotcore.Configuration.parse('{"version": 1, "sensor_interval": 0.5}')
+        with self.assertRaisesRegex(ValueError, '<= 1'):
+            iotcore.Configuration.parse('{"version": 1, "bandwidth_images": 1.5}')
+
+        parsed = iotcore.Configuration.parse(
+            '{"version": 1, "sensor_interval": 1, "bandwidth_images": 1}'
+        )
+        self.assertEqual(parsed.sensor_interval, 1.0)
+        self.assertEqual(parsed.bandwidth_images, 1.0)
+
+class TestConfigurationDevices(unittest.TestCase):
+
+    gateway = '{"version": 3, "image_interval": 300, "sensor_interval": 5}'
+    sensor = '{"version": 1, "sensor_interval": 10}'
+
+    def setUp(self):
+        self.publish = iotcore.publish
+        iotcore.publish = lambda topic, payload, qos=0: (True, 0)
+        iotcore.configuration_versions.clear()
+        iotcore.configuration_documents.clear()
+
+    def tearDown(self):
+        iotcore.publish = self.publish
+        iotcore.configuration_versions.clear()
+        iotcore.configuration_documents.clear()
+        iotcore.configuration_apply(iotcore.Configuration())
+
+    def check(self):
+        self.assertEqual(iotcore.configuration.version, 3)
+        self.assertEqual(iotcore.configuration.image_interval, 300)
+        self.assertEqual(iotcore.configuration.sensor_interval, 10)
+        self.assertEqual(iotcore.sensor_interval.value, 10)
+
+    def test_gateway_then_sensor(self):
+        iotcore.configuration_update(iotcore.connection_gateway, self.gateway)
+        self.assertEqual(iotcore.configuration.sensor_interval, 5)
+        iotcore.configuration_update('sensor', self.sensor)
+        self.check()
+
+    def test_sensor_then_gateway(self):
+        iotcore.configuration_update('sensor', self.sensor)
+        iotcore.configuration_update(iotcore.connection_gateway, self.gateway)
+        self.check()
+
+class TestCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.states = list()
+        self.handlers = dict(iotcore.commands_handlers)
+        self.command_state = iotcore.command_state
+
+        iotcore.command_state = lambda device, name, status, result=None: \
+            self.states.append((name, status, result))
+        iotcore.commands_pool = None
+        iotcore.commands_workers = 1
+
+    def tearDown(self):
+        iotcore.commands_pool.shutdown()
+        iotcore.commands_pool = None
+        iotcore.commands_workers = 2
+        iotcore.command_state = self.command_state
+        iotcore.commands_handlers.clear()
+        iotcore.commands_handlers.update(self.handlers)
+
+    def test_queued_command_is_cancelled(self):
+        ran = list()
+        release = threading.Event()
+
+        iotcore.command('slow', timeout=0.1)(lambda device, payload: release.wait())
+        iotcore.command('fast', timeout=0.1)(lambda device, payload: ran.append(payload))
+
+        slow = iotcore.command_dispatch('sensor', '/devices/sensor/commands/slow', '')
+        fast = iotcore.command_dispatch('sensor', '/devices/sensor/commands/fast', 'x')
+
+        time.sleep(0.3)
+        release.set()
+        slow.result(timeout=5)
+
+        # the slow command times out from its start, the fast one never runs
+        self.assertEqual(sorted(self.states), [
+            ('fast', 'cancelled', None),
+            ('slow', 'timeout', None),
+        ])
+        self.assertTrue(fast.cancelled())
+        self.assertEqual(ran, [])
+
+    def test_timeout_starts_with_the_command(self):
+        release = threading.Event()
+
+        iotcore.command('first', timeout=1)(lambda device, payload: release.wait(0.3))
+        iotcore.command('second', timeout=0.5)(
+            lambda device, payload: release.wait(0.3) or 'done'
+        )
+
+        iotcore.command_dispatch('sensor', '/devices/sensor/commands/first', '')
+        second = iotcore.command_dispatch('sensor', '/devices/sensor/commands/second', '')
+        second.result(timeout=5)
+
+        # queued 0.3s and ran 0.3s, within timeout from its start
+
+        self.assertEqual(self.states, [
+            ('first', 'ok', False),
+            ('second', 'ok', 'done'),
+        ])
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.workers = dict(iotcore.supervisor_workers)
+        iotcore.supervisor_workers.clear()
+
+    def tearDown(self):
+        iotcore.supervisor_workers.clear()
+        iotcore.supervisor_workers.update(self.workers)
+
+    def register(self, target, timeout=None):
+        iotcore.supervisor_register('worker', target, timeout=timeout)
+        worker = iotcore.supervisor_workers['worker']
+        iotcore.supervisor_check(worker, time.monotonic())
+        return worker
+
+    def die(self, worker, now):
+        # the worker exits, the supervisor schedules its restart
+        worker['worker'].join()
+        iotcore.supervisor_check(worker, now)
+        return worker['next_start'] - now
+
+    def test_backoff(self):
+        worker = self.register(lambda: None)
+        now = time.monotonic()
+
+        delays = list()
+        for _ in range(4):
+            delay = self.die(worker, now)
+            delays.append(delay)
+            now += delay
+            iotcore.supervisor_check(worker, now)
+
+        self.assertEqual(
+            [round(delay / iotcore.supervisor_backoff) for delay in delays],
+            [1, 2, 4, 8]
+        )
+        self.assertIsNone(worker['next_start'])
+
+    def test_backoff_max(self):
+        worker = self.register(lambda: None)
+        worker['failures'] = 30
+
+        self.assertEqual(
+            self.die(worker, time.monotonic()), iotcore.supervisor_backoff_max
+        )
+
+    def test_restarts_max(self):
+        worker = self.register(lambda: None)
+        now = time.monotonic()
+
+        for _ in range(iotcore.supervisor_restarts_max):
+            now += self.die(worker, now)
+            iotcore.supervisor_check(worker, now)
+            self.assertFalse(worker['failed'])
+
+        # one restart too many in the window, given up
+        worker['worker'].join()
+        iotcore.supervisor_check(worker, now)
+        self.assertTrue(worker['failed'])
+
+        iotcore.supervisor_check(worker, now + iotcore.supervisor_backoff_max)
+        self.assertFalse(worker['worker'].is_alive())
+
+    def test_restarts_window(self):
+        worker = self.register(lambda: None)
+        now = time.monotonic()
+
+        # restarts older than the window don't count
+        for _ in range(2 * iotcore.supervisor_restarts_max):
+            now += self.die(worker, now) + iotcore.supervisor_restarts_window
+            iotcore.supervisor_check(worker, now)
+        self.assertFalse(worker['failed'])
+
+    def test_stale_heartbeat(self):
+        release = threading.Event()
+        worker = self.register(release.wait, timeout=10)
+        now = worker['heartbeat']
+
+        iotcore.supervisor_check(worker, now + 5)
+        self.assertFalse(worker['stale'])
+
+        iotcore.supervisor_check(worker, now + 11)
+        self.assertTrue(worker['stale'])
+
+        # a thread is only reported, a new heartbeat clears it
+        worker['heartbeat'] = now + 11
+        iotcore.supervisor_check(worker, now + 12)
+        self.assertFalse(worker['stale'])
+        self.assertTrue(worker['worker'].is_alive())
+
+        release.set()
+        worker['worker'].join()
+
+    def test_stable_resets_failures(self):
+        release = threading.Event()
+        worker = self.register(release.wait)
+        worker['failures'] = 3
+
+        iotcore.supervisor_check(worker, worker['started'] + 1)
+        self.assertEqual(worker['failures'], 3)
+        iotcore.supervisor_check(
+            worker, worker['started'] + iotcore.supervisor_stable + 1
+        )
+        self.assertEqual(worker['failures'], 0)
+
+        release.set()
+        worker['worker'].join()
+
+class TestReconnect(unittest.TestCase):
+
+    class Stop:
+        # connection_event_stop, records the backoff delays
+
+        def __init__(self):
+            self.delays = list()
+            self.stopped = False
+
+        def wait(self, timeout=None):
+            self.delays.append(timeout)
+            return self.stopped
+
+        def is_set(self):
+            return self.stopped
+
+    class RefusingClient:
+        # the tcp connection succeeds, the broker refuses the connack
+
+        def __init__(self, stop, refusals):
+            self.stop = stop
+            self.refusals = refusals
+
+        def loop(self, timeout=None):
+            if not self.refusals:
+                self.stop.stopped = True
+            self.refusals -= 1
+            return 5
+
+        def reconnect(self):
+            return 0
+
+    def setUp(self):
+        self.saved = {
+            name : getattr(iotcore, name) for name in (
+                'mqtt', 'random', 'connection_client', 'connection_event_stop',
+                'connection_jwt_ts', 'connection_expire', 'connection_attempts'
+            )
+        }
+
+        # the upper bound of the full jitter
+        iotcore.random = types.SimpleNamespace(uniform=lambda low, high: high)
+        iotcore.mqtt = types.SimpleNamespace(MQTT_ERR_SUCCESS=0)
+        iotcore.connection_event_stop = self.Stop()
+        iotcore.connection_jwt_ts = time.monotonic()
+        iotcore.connection_expire = 3600
+        iotcore.connection_attempts = 0
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(iotcore, name, value)
+
+    def test_refused_connack_backs_off(self):
+        iotcore.connection_client = self.RefusingClient(
+            iotcore.connection_event_stop, 5
+        )
+        iotcore.thread_loop_connection()
+
+        backoff = iotcore.connection_backoff
+        self.assertEqual(
+            iotcore.connection_event_stop.delays,
+            [backoff, 2 * backoff, 4 * backoff, 8 * backoff]
+        )
+
+    def test_accepted_resets(self):
+        iotcore.retry(lambda: 0)
+        iotcore.retry(lambda: 0)
+        self.assertEqual(iotcore.connection_event_stop.delays, [iotcore.connection_backoff])
+
+        # as callback_connect once the broker accepted
+        iotcore.connection_attempts = 0
+        iotcore.retry(lambda: 0)
+        self.assertEqual(iotcore.connection_event_stop.delays, [iotcore.connection_backoff])
+
+if __name__ == '__main__':
+    unittest.main()
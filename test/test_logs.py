@@ -0,0 +1,57 @@
+import os
+import sys
+import logging
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'iotcore'))
+
+from logs import RateLimit
+
+def record(created, level=logging.INFO, lineno=10, msg='reading'):
+    record = logging.LogRecord('iotcore', level, 'iotcore.py', lineno, msg, None, None)
+    record.created = created
+    return record
+
+class TestRateLimit(unittest.TestCase):
+
+    def passed(self, limit, records):
+        return [r for r in records if limit.filter(r)]
+
+    def test_burst_and_sample(self):
+        limit = RateLimit(burst=3, period=60, sample=5)
+        records = [record(index * 0.1) for index in range(13)]
+
+        # the burst, then one every sample
+        passed = self.passed(limit, records)
+        self.assertEqual([records.index(r) for r in passed], [0, 1, 2, 7, 12])
+
+        # the sampled record reports what was dropped before it
+        self.assertEqual(passed[2].msg, 'reading')
+        self.assertEqual(passed[3].msg, 'reading [4 similar suppressed]')
+        self.assertEqual(passed[4].msg, 'reading [4 similar suppressed]')
+
+    def test_period(self):
+        limit = RateLimit(burst=2, period=60, sample=100)
+        self.passed(limit, [record(index) for index in range(5)])
+
+        # a new period starts with a burst, reporting the previous drops
+        passed = self.passed(limit, [record(100), record(101), record(102)])
+        self.assertEqual(len(passed), 2)
+        self.assertEqual(passed[0].msg, 'reading [3 similar suppressed]')
+        self.assertEqual(passed[1].msg, 'reading')
+
+    def test_sites(self):
+        limit = RateLimit(burst=1, period=60, sample=100)
+        passed = self.passed(limit, [
+            record(0, lineno=10), record(1, lineno=10), record(2, lineno=20),
+        ])
+        self.assertEqual([r.lineno for r in passed], [10, 20])
+
+    def test_errors(self):
+        limit = RateLimit(burst=1, period=60, sample=100)
+        records = [record(index, level=logging.ERROR) for index in range(10)]
+        self.assertEqual(len(self.passed(limit, records)), 10)
+        self.assertEqual(limit.sites, dict())
+
+if __name__ == '__main__':
+    unittest.main()
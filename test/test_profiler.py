@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'iotcore'))
+
+from profiler import Profiler
+
+class TestProfiler(unittest.TestCase):
+
+    def written(self, path):
+        try:
+            with open(path) as file:
+                return file.read().endswith(os.linesep)
+        except FileNotFoundError:
+            return False
+
+    def test_alerts_on_each_threshold(self):
+        profiler = Profiler(None, thresholds={'fds' : 10})
+
+        self.assertEqual(profiler.check({'ts' : 0, 'fds' : 20}), [])
+        self.assertEqual(profiler.check({'ts' : 1, 'fds' : 25}), [])
+        self.assertEqual(profiler.check({'ts' : 2, 'fds' : 31}), ['fds'])
+        self.assertEqual(profiler.check({'ts' : 3, 'fds' : 35}), [])
+        self.assertEqual(profiler.check({'ts' : 4, 'fds' : 41}), ['fds'])
+
+    def test_start_sample_stop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile')
+            profiler = Profiler(path, interval=60)
+
+            self.assertTrue(profiler.toggle())
+
+            # the first sample is written by the profiler thread, the next
+            # one in 60s
+            deadline = time.monotonic() + 10
+            while not self.written(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(self.written(path))
+            profiler.write(profiler.sample())
+            self.assertFalse(profiler.toggle())
+
+            with open(path) as file:
+                samples = [json.loads(line) for line in file]
+
+            self.assertEqual(len(samples), 2)
+            for name in ('rss', 'threads', 'fds', 'tempfiles', 'traced'):
+                self.assertIn(name, samples[-1])
+            self.assertIn('growth', samples[-1])
+
+if __name__ == '__main__':
+    unittest.main()
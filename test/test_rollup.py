@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'clients', 'pubsub-reader')
+)
+
+import rollup
+
+day = 1622419200
+
+class TestRollup(unittest.TestCase):
+
+    def test_close(self):
+        r = rollup.Rollup(None)
+
+        # the bucket before the first row is merged once, in case it was
+        # left open by the previous instance
+
+        self.assertEqual(r.close(day + 10), [
+            ('sensor_minute', day - 60, day),
+            ('sensor_hour', day - 3600, day),
+            ('sensor_day', day - 86400, day),
+        ])
+        self.assertEqual(r.close(day + 50), [])
+
+        self.assertEqual(r.close(day + 3605), [
+            ('sensor_minute', day, day + 60),
+            ('sensor_hour', day, day + 3600),
+        ])
+
+    def test_close_late(self):
+        r = rollup.Rollup(None)
+        r.close(day + 7200)
+
+        self.assertEqual(r.close(day + 30), [
+            ('sensor_minute', day, day + 60),
+            ('sensor_hour', day, day + 3600),
+        ])
+        self.assertEqual(r.dirty['sensor_day'], {day})
+
+    def test_close_many(self):
+        r = rollup.Rollup(None)
+        r.close(day + 10)
+
+        # catching up on three hours is a range per level
+        self.assertEqual(r.close_many(range(day, day + 3 * 3600 + 10, 10)), [
+            ('sensor_minute', day, day + 3 * 3600),
+            ('sensor_hour', day, day + 3 * 3600),
+        ])
+        self.assertEqual(r.close_many([day + 3 * 3600 + 20]), [])
+
+    def test_pick_table(self):
+        self.assertEqual(rollup.pick_table(0, 3600), ('readings', 3))
+        self.assertEqual(rollup.pick_table(0, 86400, 90), ('sensor_minute', 60))
+        self.assertEqual(rollup.pick_table(0, 86400, 7200), ('sensor_hour', 7200))
+        self.assertEqual(rollup.pick_table(0, 3 * 365 * 86400)[0], 'sensor_day')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'iotcore'))
+
+from sampling import AdaptiveSampler
+
+class TestAdaptiveSampler(unittest.TestCase):
+
+    def run_stable(self, sampler, now=0, readings=50):
+        for _ in range(readings):
+            interval = sampler.update(now, 50.0, 20.0)
+            now += interval
+        return now
+
+    def test_stable_grows_to_ceiling(self):
+        sampler = AdaptiveSampler(floor=3, ceiling=60)
+        self.run_stable(sampler)
+        self.assertEqual(sampler.interval, 60)
+
+    def test_change_drops_interval(self):
+        sampler = AdaptiveSampler(floor=3, ceiling=60)
+        now = self.run_stable(sampler)
+
+        # 0.1 celsius a second, a 0.3 threshold needs a reading every 3s
+
+        t = 20.0
+        for _ in range(10):
+            t += 0.1 * sampler.interval
+            now += sampler.interval
+            sampler.update(now, 50.0, t)
+
+        self.assertLess(sampler.interval, 10)
+
+    def test_spike_resets_to_floor(self):
+        sampler = AdaptiveSampler(floor=3, ceiling=60)
+        now = self.run_stable(sampler)
+        self.assertEqual(sampler.update(now, 50.0, 30.0, 0, 2), 3)
+
+    def test_missing_keeps_interval(self):
+        sampler = AdaptiveSampler(floor=3, ceiling=60)
+        now = self.run_stable(sampler)
+        self.assertEqual(sampler.update(now, 50.0, 20.0, 1, 1), 60)
+
+    def test_configure_clamps(self):
+        sampler = AdaptiveSampler(floor=3, ceiling=60)
+        self.run_stable(sampler)
+        self.assertEqual(sampler.configure(3, 30), 30)
+        self.assertEqual(sampler.configure(45, 30), 45)
+
+if __name__ == '__main__':
+    unittest.main()
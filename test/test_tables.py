@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'clients', 'pubsub-reader')
+)
+
+import tables
+
+class TestCache(unittest.TestCase):
+
+    def test_hit(self):
+        cache = tables.Cache(ttl=60)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+
+    def test_expired_dropped(self):
+        cache = tables.Cache(ttl=0.05)
+        for end in range(10):
+            cache.get(('history', end), lambda: end)
+        time.sleep(0.1)
+
+        # a new minute of history drops the expired ones
+        cache.get(('history', 10), lambda: 10)
+        self.assertEqual(list(cache.entries), [('history', 10)])
+
+    def test_size(self):
+        cache = tables.Cache(ttl=60, size=3)
+        for end in range(5):
+            cache.get(end, lambda: end)
+        self.assertEqual(list(cache.entries), [2, 3, 4])
+
+        # refreshed entries move to the end
+        cache.entries[2] = (0, 2)
+        cache.get(2, lambda: 'again')
+        self.assertEqual(list(cache.entries), [3, 4, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+import sys
+import base64
+import pathlib
+import unittest
+
+sys.path.insert(
+    0, pathlib.Path(__file__).resolve().parent.parent.joinpath('iotcore').as_posix()
+)
+
+import telemetry
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_roundtrip(self):
+        data = telemetry.encode(1622422583974, 55.1, -12.34, 1, 2)
+        self.assertEqual(len(data), 16)
+        self.assertEqual(
+            telemetry.decode(data),
+            telemetry.Reading(1622422583974, 55.1, -12.34, 1, 2)
+        )
+
+    def test_smaller_than_csv(self):
+        args = (1622422583974, 55.1, 21.3, 0, 0)
+        self.assertLessEqual(
+            len(telemetry.encode(*args)) * 3, len(telemetry.encode_csv(*args))
+        )
+
+    def test_legacy_csv(self):
+        data = base64.b64decode(
+            'MjAyMS0wNS0zMSAwMDo1NjoyMy45NzQ3ODIrMDA6MDAsMC4wMCwwLjAwLDEsMQ=='
+        )
+        self.assertEqual(
+            telemetry.decode(data),
+            telemetry.Reading(1622422583975, 0.0, 0.0, 1, 1)
+        )
+
+    def test_legacy_csv_without_microseconds(self):
+        reading = telemetry.decode('2021-05-31 00:56:23+00:00,55.10,21.30,0,2')
+        self.assertEqual(reading.date, 1622422583000)
+        self.assertEqual(reading.flag_temperature, 2)
+
+    def test_unknown_version(self):
+        data = telemetry.MAGIC + bytes([99]) + bytes(13)
+        with self.assertRaises(ValueError):
+            telemetry.decode(data)
+
+    def test_decode_many(self):
+        payloads = [
+            telemetry.encode(1622422583974, 55.1, 21.3, 0, 0),
+            telemetry.encode_csv(1622422586974, 55.2, 21.4, 1, 0),
+            b'garbage',
+            b'RT',
+            telemetry.encode(1622422589974, 55.3, 21.5, 0, 2),
+        ]
+        readings = telemetry.decode_many(payloads)
+        self.assertEqual(readings[0], telemetry.decode(payloads[0]))
+        self.assertEqual(readings[1], telemetry.decode(payloads[1]))
+        self.assertIsNone(readings[2])
+        self.assertIsNone(readings[3])
+        self.assertEqual(readings[4].flag_temperature, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import pathlib
+import tempfile
+import unittest
+import threading
+import urllib.error
+import urllib.request
+
+sys.path.insert(
+    0, pathlib.Path(__file__).resolve().parent.parent.joinpath('iotcore').as_posix()
+)
+
+from timeseries import TimeSeries
+from timeseries import build_server
+
+class TestTimeSeries(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkstemp(suffix='.ts')[1]
+        os.truncate(self.path, 0)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_append_and_query(self):
+        with TimeSeries(self.path, capacity=100) as store:
+            for i in range(10):
+                store.append(i * 1000, 50 + i, 20 + i / 10, 0, 2 if i == 5 else 0)
+
+            self.assertEqual(len(store), 10)
+            self.assertEqual(store.latest()[0].date, 9000)
+            self.assertEqual(store.latest()[0].humidity, 59)
+
+            readings = store.range(2000, 5000)
+            self.assertEqual([r.date for r in readings], [2000, 3000, 4000])
+            self.assertEqual(store.range(5000, 6000)[0].flag_temperature, 2)
+
+    def test_ring(self):
+        with TimeSeries(self.path, capacity=8) as store:
+            for i in range(20):
+                store.append(i * 1000, i, i)
+
+            self.assertEqual(len(store), 8)
+            self.assertEqual(
+                [r.date for r in store.range()], [i * 1000 for i in range(12, 20)]
+            )
+            self.assertEqual(
+                [r.date for r in store.range(14500, 17000)], [15000, 16000]
+            )
+            self.assertEqual(
+                [r.date for r in store.latest(3)], [17000, 18000, 19000]
+            )
+
+    def test_aggregate(self):
+        with TimeSeries(self.path, capacity=100) as store:
+            for i in range(6):
+                store.append(i * 1000, 50 + i, 20, flag_humidity=1 if i == 4 else 0)
+
+            buckets = store.aggregate(bucket=3000)
+            self.assertEqual([b['date'] for b in buckets], [0, 3000])
+            self.assertEqual(buckets[0]['count'], 3)
+            self.assertEqual(buckets[0]['humidity_min'], 50)
+            self.assertEqual(buckets[0]['humidity_avg'], 51)
+            self.assertEqual(buckets[0]['humidity_max'], 52)
+            self.assertEqual(buckets[1]['flagged'], 1)
+
+    def test_out_of_order(self):
+        with TimeSeries(self.path, capacity=10) as store:
+            store.append(2000, 50, 20)
+            with self.assertRaises(ValueError):
+                store.append(1000, 50, 20)
+
+    def test_reopen(self):
+        with TimeSeries(self.path, capacity=10) as store:
+            store.append(1000, 50.25, -3.5)
+
+        with TimeSeries(self.path) as store:
+            self.assertEqual(store.capacity, 10)
+            self.assertEqual(store.latest()[0].temperature, -3.5)
+            self.assertEqual(store.latest()[0].humidity, 50.25)
+
+    def test_server(self):
+        with TimeSeries(self.path, capacity=100) as store:
+            store.append(1000, 50, 20, 0, 0)
+
+            server = build_server(store, port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = 'http://localhost:{}'.format(server.server_address[1])
+
+            try:
+                with urllib.request.urlopen(url + '/latest?n=1') as response:
+                    self.assertEqual(response.status, 200)
+
+                # a malformed parameter is a bad request, not a dropped
+                # connection
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    urllib.request.urlopen(url + '/latest?n=abc')
+                self.assertEqual(error.exception.code, 400)
+
+                for query in ('/aggregate?bucket=0', '/aggregate?bucket=-1', '/latest?n=-1'):
+                    with self.assertRaises(urllib.error.HTTPError) as error:
+                        urllib.request.urlopen(url + query)
+                    self.assertEqual(error.exception.code, 400)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_server_devices(self):
+        other = self.path + '.sensor-1'
+        with TimeSeries(self.path, capacity=100) as first, \
+                TimeSeries(other, capacity=100) as second:
+            first.append(1000, 50, 20, 0, 0)
+            second.append(2000, 60, 25, 0, 0)
+
+            stores = {'sensor' : first, 'sensor-1' : second}
+            server = build_server(first, port=0, stores=stores)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = 'http://localhost:{}'.format(server.server_address[1])
+
+            try:
+                for path, date in (
+                    ('/latest', 1000),
+                    ('/sensor/latest', 1000),
+                    ('/sensor-1/latest', 2000),
+                ):
+                    with urllib.request.urlopen(url + path) as response:
+                        self.assertEqual(json.loads(response.read())[0]['date'], date)
+
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    urllib.request.urlopen(url + '/sensor-2/latest')
+                self.assertEqual(error.exception.code, 404)
+            finally:
+                server.shutdown()
+                server.server_close()
+                os.remove(other)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), '..', 'clients', 'pubsub-reader')
+)
+
+import worker
+
+class FailingSink:
+
+    def write(self, rows, ids):
+        raise RuntimeError('insert_rows failed')
+
+class TestWorker(unittest.TestCase):
+
+    def test_batches(self):
+        sink = worker.FakeSink(latency=0, row_latency=0)
+        batcher = worker.Batcher(sink, batch=10, linger=0.01)
+        batcher.start()
+
+        messages = worker.fake_messages(25)
+        messages.append(worker.FakeMessage(b'junk', {'deviceId' : 'sensor'}, 'junk'))
+        messages.append(worker.FakeMessage(b'', {'deviceId' : 'camera'}, 'camera'))
+        for message in messages:
+            batcher.add(message)
+        batcher.stop()
+
+        # undecodable and foreign messages are acked without a row
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(sink.rows, 25)
+        self.assertEqual(sink.writes, 3)
+        self.assertEqual(batcher.undecodable, 1)
+        self.assertEqual(batcher.ignored, 1)
+
+    def test_linger(self):
+        sink = worker.FakeSink(latency=0, row_latency=0)
+        batcher = worker.Batcher(sink, batch=1000, linger=0.05)
+        batcher.start()
+
+        # a partial batch is written after linger, without stop
+        messages = worker.fake_messages(5)
+        for message in messages:
+            batcher.add(message)
+
+        deadline = time.monotonic() + 5
+        while batcher.acked < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(sink.writes, 1)
+        batcher.stop()
+
+    def test_truncated(self):
+        sink = worker.FakeSink(latency=0, row_latency=0)
+        batcher = worker.Batcher(sink, batch=3, linger=0.01)
+        batcher.start()
+
+        # a truncated payload doesn't stop the batches after it
+        messages = [worker.FakeMessage(b'RT', {'deviceId' : 'sensor'}, 'short')]
+        messages += worker.fake_messages(4)
+        for message in messages:
+            batcher.add(message)
+        batcher.stop()
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(batcher.undecodable, 1)
+        self.assertEqual(sink.rows, 4)
+
+    def test_failed_write(self):
+        batcher = worker.Batcher(FailingSink(), batch=10, linger=0.01)
+        batcher.start()
+
+        messages = worker.fake_messages(5)
+        for message in messages:
+            batcher.add(message)
+        batcher.stop()
+
+        self.assertTrue(all(message.acked is False for message in messages))
+        self.assertEqual(batcher.nacked, 5)
+        self.assertEqual(batcher.acked, 0)
+
+if __name__ == '__main__':
+    unittest.main()